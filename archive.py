@@ -0,0 +1,260 @@
+import os
+import py7zr
+import py7zr.io
+import sys
+import tempfile
+import zipfile
+
+import sevenzip
+
+# Size of the blocks read from a file or an archive member when hashing
+CHUNK_SIZE = 1024 * 1024
+# Whole members bigger than this are spilled from memory to a temporary file
+SPOOL_SIZE = 64 * 1024 * 1024
+
+class HeaderComplete(Exception):
+	# Raised from a writer to stop py7zr once the bytes we wanted are decompressed
+	pass
+
+class Spool:
+	"""
+	A whole decompressed member: it stays in memory (data) up to maxSize bytes, and is spilled past
+	that to a named temporary file in dir (path), which a parser can open once finish() was called.
+	close() removes the file, call it in a finally.
+	"""
+	def __init__(self, suffix: str = '', maxSize: int = SPOOL_SIZE, dir: str | None = None):
+		self.suffix = suffix
+		self.maxSize = maxSize
+		self.dir = dir
+		self.data = bytearray()
+		self.file = None
+		self.path = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def write(self, s):
+		if self.file is None and len(self.data) + len(s) > self.maxSize:
+			self.file = tempfile.NamedTemporaryFile(suffix=self.suffix, dir=self.dir, delete=False)
+			self.path = self.file.name
+			self.file.write(self.data)
+			self.data = bytearray()
+		if self.file is not None:
+			self.file.write(s)
+		else:
+			self.data += s
+
+	def finish(self):
+		# The member is complete: the temporary file can be opened by its path
+		if self.file is not None:
+			self.file.close()
+
+	def read(self) -> bytes:
+		if self.path is None:
+			return bytes(self.data)
+		self.finish()
+		with open(self.path, 'rb') as f:
+			return f.read()
+
+	def close(self):
+		self.data = bytearray()
+		if self.file is not None:
+			self.file.close()
+			os.remove(self.path)
+			self.file = None
+			self.path = None
+
+class MemberIO(py7zr.io.Py7zIO):
+	# py7zr writes the decompressed member here: it goes to the sink (and the spool, if any) while it
+	# streams out, and only its first bytes are kept. They're handed to onComplete once the member is
+	# complete, and dropped.
+	def __init__(self, sink = None, keepSize: int | None = 0, stopWhenKept = False, spool = None, fileName = None,
+			onComplete = None, expectedSize: int | None = None):
+		self.sink = sink
+		self.keepSize = keepSize
+		self.stopWhenKept = stopWhenKept
+		self.spool = spool
+		self.fileName = fileName
+		self.onComplete = onComplete
+		self.expectedSize = expectedSize
+		self.data = bytearray()
+		self._size = 0
+		# An exception already being handled when the member is opened isn't one of its own
+		self._handled = sys.exc_info()[1]
+
+	def write(self, s) -> int:
+		if self.sink is not None:
+			self.sink.update(s)
+		if self.spool is not None:
+			self.spool.write(s)
+		if self.keepSize is None:
+			self.data += s
+		elif len(self.data) < self.keepSize:
+			self.data += s[:self.keepSize - len(self.data)]
+		self._size += len(s)
+		if self.stopWhenKept and len(self.data) >= self.keepSize:
+			raise HeaderComplete()
+		return len(s)
+
+	def read(self, size = None) -> bytes:
+		return bytes(self.data)
+
+	def seek(self, offset: int, whence: int = 0) -> int:
+		return 0
+
+	def flush(self) -> None:
+		pass
+
+	def close(self) -> None:
+		# py7zr may close a member while leaving the block it's written in, even when its decompression
+		# or its CRC check just failed: it's only complete with all its bytes and no exception in flight
+		exception = sys.exc_info()[1]
+		if isinstance(exception, HeaderComplete):
+			# Only the header was wanted, readMembers() completes it
+			return
+		failed = exception not in (None, self._handled)
+		if failed or (self.expectedSize is not None and self._size != self.expectedSize):
+			self.onComplete = None
+			self.data = bytearray()
+		else:
+			self.complete()
+
+	def complete(self) -> None:
+		# Hands the kept bytes to onComplete, only once
+		if self.onComplete is not None:
+			onComplete, self.onComplete = self.onComplete, None
+			data, self.data = bytes(self.data), bytearray()
+			onComplete(self.fileName, data)
+
+	def size(self) -> int:
+		return self._size
+
+class MemberIOFactory(py7zr.io.WriterFactory):
+	def __init__(self, sinks: dict, keepSize: int | None = 0, stopWhenKept = False, spools: dict = {}, onComplete = None,
+			sizes: dict = {}):
+		self.sinks = sinks
+		self.keepSize = keepSize
+		self.stopWhenKept = stopWhenKept
+		self.spools = spools
+		self.onComplete = onComplete
+		self.sizes = sizes
+		self.products = {}
+
+	def create(self, filename: str) -> py7zr.io.Py7zIO:
+		product = MemberIO(self.sinks.get(filename), self.keepSize, self.stopWhenKept, self.spools.get(filename),
+			filename, self.onComplete, self.sizes.get(filename))
+		self.products[filename] = product
+		return product
+
+class Archive:
+	# An open zip or 7z archive, where each member is decompressed only once
+	known_archive_extentions = ['zip', '7z']
+
+	def __init__(self, path: str, ext: str, chunkSize = CHUNK_SIZE, stats: dict | None = None):
+		if ext not in self.known_archive_extentions:
+			raise ValueError("%s is not a supported archive" % path)
+		self.path = path
+		self.ext = ext
+		self.chunkSize = chunkSize
+		# Bytes really decompressed are added to stats['decompressed'], even if the decompression fails
+		self.stats = stats if stats is not None else {}
+		self.stats.setdefault('decompressed', 0)
+		self._handle = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	@property
+	def handle(self):
+		# Only opened when needed: a 7z listing doesn't go through py7zr at all
+		if self._handle is None:
+			if self.ext == 'zip':
+				self._handle = zipfile.ZipFile(self.path)
+			else:
+				self._handle = py7zr.SevenZipFile(self.path, 'r')
+		return self._handle
+
+	def close(self):
+		if self._handle is not None:
+			self._handle.close()
+
+	def list(self) -> list:
+		# Same layout as Rom.archiveContent: one {filename: crc} dict per member
+		return [{m['name']: m['crc'].lstrip('0') or '0'} for m in self.members()]
+
+	def members(self) -> list:
+		# Name, size and CRC of every member, as written in the archive directory: nothing is decompressed
+		members = []
+		if self.ext == 'zip':
+			for f in self.handle.infolist():
+				members.append({'name': f.filename, 'size': f.file_size, 'crc': f'{f.CRC:08x}'})
+		else:
+			try:
+				return sevenzip.listMembers(self.path)
+			except sevenzip.SevenZipHeaderError:
+				# Headers we can't decode alone (encrypted ones for example) are left to py7zr
+				for f in self.handle.list():
+					members.append({'name': f.filename, 'size': f.uncompressed, 'crc': f'{f.crc32 or 0:08x}'})
+		return members
+
+	def readMembers(self, sinks: dict, keepSize: int | None = 0, onMember = None, spools: dict = {}) -> dict:
+		"""
+		Decompress the members named in sinks once, feeding each one to its sink (anything with
+		an update(bytes) method, like a Hasher) while it streams out. Returns the first keepSize
+		bytes of every member, or the whole member if keepSize is None.
+		Members without a sink are only decompressed up to keepSize bytes when possible.
+		With onMember, each member is given to onMember(fileName, data) as soon as it's complete
+		instead, so only one is held at a time (py7zr may call it from its own threads).
+		The whole members wanted with a bounded memory are written to their Spool in spools.
+		"""
+		kept = {}
+		if onMember is None:
+			onMember = kept.__setitem__
+		if self.ext == 'zip':
+			for fileName, sink in sinks.items():
+				data = bytearray()
+				spool = spools.get(fileName)
+				with self.handle.open(fileName) as f:
+					if sink is None and spool is None and keepSize is not None:
+						data = f.read(keepSize)
+						self.stats['decompressed'] += len(data)
+						onMember(fileName, data)
+						continue
+					while chunk := f.read(self.chunkSize):
+						self.stats['decompressed'] += len(chunk)
+						if sink is not None:
+							sink.update(chunk)
+						if spool is not None:
+							spool.write(chunk)
+						if keepSize is None:
+							data += chunk
+						elif len(data) < keepSize:
+							data += chunk[:keepSize - len(data)]
+				onMember(fileName, bytes(data))
+				del data
+		else:
+			# A single member is only decompressed until its header is complete
+			stopWhenKept = len(sinks) == 1 and None in sinks.values() and keepSize is not None and not spools
+			# A member is only complete once it has all the bytes of its directory size
+			sizes = {f.filename: f.uncompressed for f in self.handle.files if f.filename in sinks}
+			factory = MemberIOFactory(sinks, keepSize, stopWhenKept, spools, onMember, sizes)
+			try:
+				self.handle.extract(targets=list(sinks.keys()), factory=factory)
+			except HeaderComplete:
+				# Stopped before the member was complete: its header is
+				for product in factory.products.values():
+					product.complete()
+			finally:
+				self.stats['decompressed'] += sum(product.size() for product in factory.products.values())
+				# py7zr has to rewind before the archive can be read again
+				self.handle.reset()
+		return kept
+
+	def readMember(self, fileName: str, sink = None, keepSize: int | None = None) -> bytes:
+		return self.readMembers({fileName: sink}, keepSize)[fileName]
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Time a scan of a mixed corpus (plain roms, zips, solid 7z archives of several roms) with thread and
+process executors, from 1 to --max-jobs jobs, to see how far each one scales. The corpus is written
+to a temporary folder from the Game Boy headers of the pyrominfo tests, padded with random data.
+
+    python benchmarks/bench_executor.py [--files N] [--size KiB] [--max-jobs 16]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+import py7zr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEADERS = [os.path.join(ROOT, 'extlibs', 'pyrominfo', 'tests', 'data', name)
+    for name in ('Tetris.gb', 'The Legend of Zelda - Links Awakening DX.gbc')]
+
+def make_rom(index: int, size: int) -> bytes:
+    with open(HEADERS[index % len(HEADERS)], 'rb') as f:
+        header = f.read(0x150)
+    return header + os.urandom(max(size - len(header), 0))
+
+def make_corpus(path: str, nb_files: int, size: int):
+    # A third of plain roms, a third of zips, a third of 7z archives of 4 roms
+    for i in range(nb_files):
+        name = 'rom%05d' % i
+        ext = '.gbc' if i % len(HEADERS) else '.gb'
+        if i % 3 == 0:
+            with open(os.path.join(path, name + ext), 'wb') as f:
+                f.write(make_rom(i, size))
+        elif i % 3 == 1:
+            with zipfile.ZipFile(os.path.join(path, name + '.zip'), 'w', zipfile.ZIP_DEFLATED) as z:
+                z.writestr(name + ext, make_rom(i, size))
+        else:
+            with py7zr.SevenZipFile(os.path.join(path, name + '.7z'), 'w') as z:
+                for j in range(4):
+                    z.writestr(make_rom(i + j, size // 4), '%s-%d%s' % (name, j, ext))
+
+def scan(corpus: str, tmpdir: str, executor: str, jobs: int) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), corpus, '-s', 'gb', '--no-cache',
+        '--executor', executor, '-j', str(jobs), '--journal', os.path.join(tmpdir, 'journal.jsonl')],
+        check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scaling of the thread and process executors')
+    parser.add_argument("--files", help="Number of files of the corpus", type=int, default=300)
+    parser.add_argument("--size", help="Size in KiB of each rom, or of the roms of an archive together", type=int, default=2048)
+    parser.add_argument("--max-jobs", help="Highest number of jobs, doubled from 1", type=int, default=16)
+    parser.add_argument("--executors", help="Executors to compare", nargs='+', choices=['thread', 'process'], default=['thread', 'process'])
+    args = parser.parse_args()
+
+    jobs = [1]
+    while jobs[-1] * 2 <= args.max_jobs:
+        jobs.append(jobs[-1] * 2)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus = os.path.join(tmpdir, 'corpus')
+        os.mkdir(corpus)
+        print("Writing a corpus of %d files of %d KiB..." % (args.files, args.size))
+        make_corpus(corpus, args.files, args.size * 1024)
+        # Read once, so every run finds the corpus in the page cache
+        scan(corpus, tmpdir, 'thread', 1)
+        print("%d CPU(s)" % os.cpu_count())
+        print("%-8s %5s %10s %10s %8s" % ('executor', 'jobs', 'time (s)', 'files/s', 'speedup'))
+        for executor in args.executors:
+            single = None
+            for nb_jobs in jobs:
+                elapsed = scan(corpus, tmpdir, executor, nb_jobs)
+                single = single or elapsed
+                print("%-8s %5d %10.2f %10.1f %7.2fx" % (executor, nb_jobs, elapsed, args.files / elapsed, single / elapsed))
+
+if __name__ == '__main__':
+    main()
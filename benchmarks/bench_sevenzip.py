@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Time the listing of 7z archives: sevenzip.listMembers(), which only reads the header, against
+py7zr's list(), which opens the whole archive. Without archives given, a large solid archive is
+written to a temporary folder first.
+
+    python benchmarks/bench_sevenzip.py [--files N] [--size MiB] [ARCHIVE.7z...]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import py7zr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sevenzip
+
+def make_archive(path: str, nb_files: int, size: int):
+    # Incompressible members, so the archive really is that big
+    with py7zr.SevenZipFile(path, 'w') as z:
+        for i in range(nb_files):
+            z.writestr(os.urandom(size // nb_files), 'roms/rom%05d.bin' % i)
+
+def list_py7zr(path: str) -> list:
+    with py7zr.SevenZipFile(path, 'r') as z:
+        return z.list()
+
+def best_time(fn, path: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(path)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the listing of 7z archives')
+    parser.add_argument("archives", nargs='*', help="Archives to list (default: a generated solid archive)")
+    parser.add_argument("--files", help="Number of files of the generated archive", type=int, default=2000)
+    parser.add_argument("--size", help="Size in MiB of the generated archive", type=int, default=256)
+    parser.add_argument("--repeat", help="Number of runs, the best one is kept", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archives = args.archives
+        if not archives:
+            archives = [os.path.join(tmpdir, 'solid.7z')]
+            print("Writing a solid archive of %d files, %d MiB..." % (args.files, args.size))
+            make_archive(archives[0], args.files, args.size * 1024 * 1024)
+        print("%-40s %8s %12s %12s %8s" % ('archive', 'files', 'header (ms)', 'py7zr (ms)', 'speedup'))
+        for path in archives:
+            nb_files = len(sevenzip.listMembers(path))
+            header = best_time(sevenzip.listMembers, path, args.repeat)
+            full = best_time(list_py7zr, path, args.repeat)
+            print("%-40s %8d %12.2f %12.2f %7.1fx" % (os.path.basename(path)[-40:], nb_files, header * 1000, full * 1000, full / header))
+
+if __name__ == '__main__':
+    main()
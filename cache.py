@@ -0,0 +1,105 @@
+import json
+import os
+import sqlite3
+import time
+
+"""
+Persistent cache of the parsing results, so unchanged files are neither hashed nor parsed again.
+A file is identified by its device, inode, size and modification time: if any of them changes,
+the cached entry doesn't match anymore. Entries are per system too: an archive parsed as a rom of
+another system can give another result. An entry of a --fast-crc scan only has what the archive
+directory tells, it's a miss for a scan which parses the headers. Files which couldn't be parsed are
+cached too, with their error, so an unchanged unknown file isn't tried again at each scan.
+"""
+
+HASH_COLUMNS = ['crc', 'md5', 'sha1', 'sha256']
+# Several scans (shards of one) can share the cache: none keeps it locked for long
+COMMIT_INTERVAL = 1.0
+LOCK_TIMEOUT = 60.0
+# The entries of a cache of another version are dropped
+SCHEMA_VERSION = 3
+
+def default_cache_path() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'prf', 'cache.db')
+
+def file_identity(st: os.stat_result) -> tuple:
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+class RomCache:
+    def __init__(self, path: str = None, rebuild: bool = False, system: str = ''):
+        self.path = path or default_cache_path()
+        self.system = system
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+        self.last_commit = time.monotonic()
+        if rebuild or self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS roms")
+            self.db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS roms (
+            path TEXT, system TEXT,
+            device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER,
+            crc TEXT, md5 TEXT, sha1 TEXT, sha256 TEXT,
+            props TEXT, fast_crc INTEGER, error TEXT,
+            PRIMARY KEY (path, system))""")
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def get(self, path: str, st: os.stat_result, hash_types = ('crc', 'md5', 'sha1'), headers: bool = True) -> tuple | None:
+        """
+        (result, error) of the file in the cache, or None if it's not cached, changed since, or its
+        entry lacks what's asked.
+        """
+        row = self.db.execute("SELECT device, inode, size, mtime_ns, crc, md5, sha1, sha256, props, fast_crc, error FROM roms WHERE path = ? AND system = ?",
+            (path, self.system)).fetchone()
+        if not row or tuple(row[0:4]) != file_identity(st):
+            return None
+        if headers and row[9]:
+            return None
+        if row[10] is not None:
+            return (None, row[10])
+        hashes = dict(zip(HASH_COLUMNS, row[4:8]))
+        result = json.loads(row[8])
+        # An entry computed with less digests than needed now is a miss
+        # Archives with several roms hold the hashes of each rom instead
+        for h in hash_types:
+            if hashes.get(h) is None and not all(h in member for member in result.get('members', [{}])):
+                return None
+        return (result, None)
+
+    def put(self, path: str, st: os.stat_result, result: dict | None, fast_crc: bool = False, error = None):
+        hashes = [result.get(h) for h in HASH_COLUMNS] if result else [None] * len(HASH_COLUMNS)
+        self.db.execute("INSERT OR REPLACE INTO roms VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, self.system, *file_identity(st), *hashes, json.dumps(result, default=str), fast_crc,
+            str(error) if error is not None else None))
+        if time.monotonic() - self.last_commit >= COMMIT_INTERVAL:
+            self.db.commit()
+            self.last_commit = time.monotonic()
+
+    def remove(self, path: str):
+        # The file is gone, for every system
+        self.db.execute("DELETE FROM roms WHERE path = ?", (path,))
+
+    def evict(self, root: str, seen_paths) -> int:
+        """
+        Remove the entries below root which were not seen during the last walk of root,
+        they belong to files that were deleted or moved. Every file walked must be seen, not only
+        the roms of the system scanned, or the entries of the other systems would go too.
+        """
+        root = os.path.join(root, '')
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM seen")
+        self.db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", ((p,) for p in seen_paths))
+        cursor = self.db.execute("DELETE FROM roms WHERE substr(path, 1, ?) = ? AND path NOT IN (SELECT path FROM seen)",
+            (len(root), root))
+        self.db.commit()
+        return cursor.rowcount
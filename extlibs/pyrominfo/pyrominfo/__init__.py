@@ -20,20 +20,48 @@ __all__ = [
 
 class RomInfo(object):
     @staticmethod
-    def parse(filename):
-        ext = None
-        for parser in RomInfoParser.getParsers():
-            if not ext:
-                ext = parser._getExtension(filename)
-            if parser.isValidExtension(ext):
-                props = parser.parse(filename)
-                if props and any(props):
-                    return props
+    def parse(filename, parsers=None):
+        """
+        If parsers is given, only these parsers are tried instead of all the
+        registered ones.
+        """
+        ext = filename[filename.rindex(".") + 1 : ].lower() if "." in filename else ""
+        for parser in RomInfo._getCandidates(ext, parsers):
+            props = parser.parse(filename)
+            if props and any(props):
+                return props
         return {}
 
     @staticmethod
-    def parseBuffer(data):
-        for parser in RomInfoParser.getParsers():
+    def _getCandidates(ext, parsers=None):
+        # Parsers of the extension, from the index built as they register
+        candidates = RomInfoParser.getParsersForExtension(ext)
+        if parsers:
+            candidates = [parser for parser in candidates if parser in parsers]
+        return candidates
+
+    @staticmethod
+    def getHeaderSize(ext, parsers=None):
+        """
+        Number of leading bytes parseBuffer() needs for a ROM with this
+        extension, or None if the whole ROM is needed.
+        """
+        sizes = [parser.getHeaderSize(ext) for parser in RomInfo._getCandidates(ext, parsers)]
+        if not sizes or None in sizes:
+            return None
+        return max(sizes)
+
+    @staticmethod
+    def parseBuffer(data, ext=None, parsers=None):
+        """
+        If ext is given, only the parsers for this extension are tried, as data
+        may only hold the first getHeaderSize(ext) bytes of the ROM.
+        """
+        if ext is not None:
+            candidates = RomInfo._getCandidates(ext, parsers)
+        else:
+            candidates = parsers or RomInfoParser.getParsers()
+        for parser in candidates:
             if parser.isValidData(data):
                 props = parser.parseBuffer(data)
                 if props and any(props):
@@ -16,6 +16,9 @@ class GameboyParser(RomInfoParser):
     def getValidExtensions(self):
         return ["gb", "gbc", "cgb", "sgb"]
 
+    def getHeaderSize(self, ext):
+        return 0x150
+
     def parse(self, filename):
         props = {}
         with open(filename, "rb") as f:
@@ -19,6 +19,9 @@ class GBAParser(RomInfoParser):
     def getValidExtensions(self):
         return ["gba", "agb"]
 
+    def getHeaderSize(self, ext):
+        return 0xc0
+
     def parse(self, filename):
         props = {}
         with open(filename, "rb") as f:
@@ -22,6 +22,10 @@ class NESParser(RomInfoParser):
     def getValidExtensions(self):
         return ["nes", "nez", "unf", "unif", "fds", "qd"]
 
+    def getHeaderSize(self, ext):
+        # UNIF and FDS images are parsed as a whole, iNES only needs its 16 bytes header
+        return None if ext in ["unf", "unif", "fds", "qd"] else 16
+
     def parse(self, filename):
         props = {}
         with open(filename, "rb") as f:
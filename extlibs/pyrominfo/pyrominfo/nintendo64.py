@@ -15,6 +15,9 @@ class Nintendo64Parser(RomInfoParser):
     def getValidExtensions(self):
         return ["n64", "v64", "z64"]
 
+    def getHeaderSize(self, ext):
+        return 64
+
     def parse(self, filename):
         props = {}
         with open(filename, "rb") as f:
@@ -16,6 +16,9 @@ class NintendoDsParser(RomInfoParser):
     def getValidExtensions(self):
         return ["nds", "dsi"]
 
+    def getHeaderSize(self, ext):
+        return 0x200
+
     def parse(self, filename):
         props = {}
         with open(filename, "rb") as f:
@@ -38,15 +38,27 @@ class RomInfoParser(object):
     """
 
     __parsers = []
+    # Extension -> parsers accepting it, in the order they were registered
+    __parsersByExtension = {}
 
     @staticmethod
     def registerParser(romInfoParser):
         RomInfoParser.__parsers.append(romInfoParser)
+        for ext in romInfoParser.getValidExtensions():
+            RomInfoParser.__parsersByExtension.setdefault(ext, []).append(romInfoParser)
 
     @staticmethod
     def getParsers():
         return RomInfoParser.__parsers
 
+    @staticmethod
+    def getParsersForExtension(ext):
+        """
+        Registered parsers accepting the extension, in the order they were
+        registered.
+        """
+        return RomInfoParser.__parsersByExtension.get(ext, [])
+
     def __init__(self):
         pass
 
@@ -56,6 +68,14 @@ class RomInfoParser(object):
     def isValidExtension(self, ext):
         return ext in self.getValidExtensions()
 
+    def getHeaderSize(self, ext):
+        """
+        Number of bytes at the beginning of a ROM with the given extension that
+        isValidData() and parseBuffer() need, or None if they need the whole
+        ROM. This lets a caller read only the header of a compressed ROM.
+        """
+        return None
+
     def parse(self, filename):
         return {}
 
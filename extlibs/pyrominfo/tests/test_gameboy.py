@@ -5,6 +5,8 @@
 
 import testutils
 
+import os
+import tempfile
 import unittest
 
 gameboy = testutils.loadModule("gameboy")
@@ -59,5 +61,21 @@ class TestGameboyParser(unittest.TestCase):
         self.assertEqual(props["header_checksum"], "3C")
         self.assertEqual(props["global_checksum"], "E3FD")
 
+    def test_header_size(self):
+        # The test roms are only their header: pad them to their real size, then parse their window
+        for filename, size in (("data/Tetris.gb", 32768), ("data/The Legend of Zelda - Links Awakening DX.gbc", 1048576)):
+            with open(filename, "rb") as f:
+                image = bytearray(f.read())
+            image += bytes(range(256)) * ((size - len(image)) // 256 + 1)
+            image = image[:size]
+            window = image[:self.gbParser.getHeaderSize("gb")]
+            self.assertLess(len(window), len(image))
+            self.assertTrue(self.gbParser.isValidData(window))
+            with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1]) as f:
+                f.write(image)
+                f.flush()
+                self.assertEqual(self.gbParser.parseBuffer(window), self.gbParser.parse(f.name))
+            self.assertEqual(self.gbParser.parseBuffer(window), self.gbParser.parseBuffer(image))
+
 if __name__ == '__main__':
     unittest.main()
@@ -5,6 +5,7 @@
 
 import testutils
 
+import tempfile
 import unittest
 
 nes = testutils.loadModule("nes")
@@ -37,6 +38,21 @@ class TestNESParser(unittest.TestCase):
         self.assertEqual(props["video_output"], "")
         self.assertEqual(props["rom_size_bytes"], 131072)
 
+    def test_header_size(self):
+        self.assertEqual(self.nesParser.getHeaderSize("nes"), 16)
+        self.assertIsNone(self.nesParser.getHeaderSize("fds"))
+        # The test rom is only its header: pad it with its 128KB of PRG ROM, then parse its window
+        with open("data/Metroid.nes", "rb") as f:
+            image = bytearray(f.read())
+        image += bytes(range(256)) * (131072 // 256)
+        window = image[:self.nesParser.getHeaderSize("nes")]
+        self.assertLess(len(window), len(image))
+        with tempfile.NamedTemporaryFile(suffix=".nes") as f:
+            f.write(image)
+            f.flush()
+            self.assertEqual(self.nesParser.parseBuffer(window), self.nesParser.parse(f.name))
+        self.assertEqual(self.nesParser.parseBuffer(window), self.nesParser.parseBuffer(image))
+
     def test_unif(self):
         props = self.nesParser.parse("data/Dancing Blocks (1990)(Sachen)(AS)[p][!][SA-013][NES cart].unf")
         self.assertEqual(len(props), 13)
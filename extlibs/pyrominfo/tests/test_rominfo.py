@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2013 Garrett Brown
+# See Copyright Notice in rominfo.py
+
+import testutils
+
+import unittest
+
+RomInfo = testutils.loadModule("RomInfo")
+rominfo = testutils.loadModule("rominfo")
+gameboy = testutils.loadModule("gameboy")
+genesis = testutils.loadModule("genesis")
+saturn = testutils.loadModule("saturn")
+genericdisc = testutils.loadModule("genericdisc")
+
+class TestRomInfo(unittest.TestCase):
+    def test_parsers_for_extension(self):
+        parsers = rominfo.RomInfoParser.getParsersForExtension("gbc")
+        self.assertEqual([type(parser) for parser in parsers], [gameboy.GameboyParser])
+        # Ambiguous extensions keep the order the parsers were registered in
+        parsers = [type(parser) for parser in rominfo.RomInfoParser.getParsersForExtension("bin")]
+        self.assertIn(genesis.GensisParser, parsers)
+        self.assertIn(saturn.SaturnParser, parsers)
+        self.assertIn(genericdisc.GenericDiscParser, parsers)
+        all_parsers = [type(parser) for parser in rominfo.RomInfoParser.getParsers()]
+        self.assertEqual(parsers, [parser for parser in all_parsers if parser in parsers])
+
+    def test_unknown_extension(self):
+        self.assertEqual(rominfo.RomInfoParser.getParsersForExtension("txt"), [])
+        self.assertEqual(RomInfo.parse("data/readme.txt"), {})
+
+    def test_parse(self):
+        props = RomInfo.parse("data/Tetris.gb")
+        self.assertEqual(props["title"], "TETRIS")
+        self.assertEqual(props["platform"], "Game Boy")
+
+    def test_parse_with_parsers(self):
+        gbParser = rominfo.RomInfoParser.getParsersForExtension("gb")[0]
+        self.assertEqual(RomInfo.parse("data/Tetris.gb", [gbParser])["title"], "TETRIS")
+        genesisParser = rominfo.RomInfoParser.getParsersForExtension("md")[0]
+        self.assertEqual(RomInfo.parse("data/Tetris.gb", [genesisParser]), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import time
+
+from cache import default_cache_path
+
+"""
+Journal of the results of a scan, so an interrupted scan can be resumed instead of started over.
+It's a JSON Lines file only ever appended to: the results are buffered and written at each checkpoint
+as whole lines, then synced to the disk. A crash can only lose the results since
+the last checkpoint, and at worst leave a truncated last line, which is ignored when reading it back.
+Since the file is opened in append mode, several writers can share it without locking.
+Each writer starts with a line giving the mode of its scan (system, hashes...): a resumed scan only
+takes the results journalled in the same mode.
+"""
+
+CHECKPOINT_INTERVAL = 5
+
+def default_journal_path(root: str, shard: tuple | None = None) -> str:
+    # One journal per scanned folder (and shard of it), next to the cache
+    name = hashlib.sha1(os.path.abspath(root).encode('utf-8', 'surrogateescape')).hexdigest()
+    if shard:
+        name += '-%d-of-%d' % shard
+    return os.path.join(os.path.dirname(default_cache_path()), 'journals', name + '.jsonl')
+
+class Journal:
+    def __init__(self, path: str, resume: bool = False, checkpoint_interval: float = CHECKPOINT_INTERVAL,
+            mode: dict | None = None, overwrite: bool = True):
+        """
+        Without resume, the journal starts empty: an existing one is overwritten, or raises
+        FileExistsError if overwrite is False.
+        """
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.mode = mode
+        self.entries = dict()
+        if resume:
+            self.load()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Unbuffered, a checkpoint goes straight to the file
+        self.file = open(path, 'ab' if resume else 'wb' if overwrite else 'xb', buffering=0)
+        self.pending = [json.dumps({'mode': mode}) + '\n']
+        self.last_checkpoint = time.monotonic()
+
+    def load(self):
+        mode = None
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Line truncated by a crash
+                        continue
+                    if 'path' not in entry:
+                        mode = entry.get('mode')
+                    elif mode == self.mode:
+                        self.entries[entry['path']] = entry
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path: str, st: os.stat_result) -> tuple | None:
+        """
+        (result, error) of the file in the journal, or None if it's not journalled or changed since.
+        """
+        entry = self.entries.get(path)
+        if not entry or (entry['size'], entry['mtime_ns']) != (st.st_size, st.st_mtime_ns):
+            return None
+        return (entry['result'], entry['error'])
+
+    def put(self, path: str, st: os.stat_result, result: dict | None, error = None):
+        entry = {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'result': result,
+            'error': str(error) if error is not None else None}
+        self.pending.append(json.dumps(entry, default=str) + '\n')
+        if time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.pending:
+            data = memoryview(''.join(self.pending).encode('utf-8', 'surrogateescape'))
+            # A write() may be partial (a full disk, a signal...): the rest is written until it's all there
+            while data:
+                data = data[os.write(self.file.fileno(), data):]
+            os.fsync(self.file.fileno())
+            self.pending = []
+        self.last_checkpoint = time.monotonic()
+
+    def close(self, remove: bool = False):
+        """
+        Checkpoint and close the journal. A scan which went to the end doesn't need it anymore: remove it.
+        """
+        self.checkpoint()
+        self.file.close()
+        if remove:
+            os.remove(self.path)
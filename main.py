@@ -2,10 +2,23 @@ import argparse
 import concurrent.futures
 import os
 import re
+import signal
+import sys
 
 import goodset
-from rom import Rom
-from extlibs.pyrominfo.pyrominfo import RomInfo
+import pipeline
+import progress
+import scanner
+import shards
+import sinks
+import storage
+import watcher
+from cache import RomCache
+from journal import CHECKPOINT_INTERVAL, Journal, default_journal_path
+from manifest import Manifest
+from rom import CHUNK_SIZE, SPOOL_SIZE, Rom
+from archive import Archive
+from extlibs.pyrominfo.pyrominfo import RomInfo, RomInfoParser
 from extlibs.pyrominfo.pyrominfo import dreamcast, gameboy, gba, genericdisc, genesis, mastersystem, nes, nintendo64, nintendods, saturn, snes
 
 
@@ -18,29 +31,117 @@ parser.add_argument("path", type=str, help="A path to roms")
 parser.add_argument("--system", "-s", help="System name of the roms folder",
     choices=['dreamcast', 'gb', 'gba', 'megadrive', 'mastersystem', 'nes', 'n64', 'nds', 'saturn', 'snes'], required=True)
 parser.add_argument("--jobs", "-j", help="Sets the number of parallel jobs to run", type=int, default=1)
+parser.add_argument("--executor", help="Run the jobs in threads, or in processes to use several cores for the parsing and hashing (auto: processes when there are several jobs)",
+    choices=['thread', 'process', 'auto'], default='thread')
+parser.add_argument("--io-jobs", help="Number of threads reading the files ahead of the parsing jobs (default: 2 with processes, none with threads)", type=int, default=-1)
+parser.add_argument("--batch-size", help="Number of files sent at once to a job (default: 1 for threads, 8 for processes)", type=int, default=0)
+parser.add_argument("--in-flight", help="Maximum number of batches being parsed or waiting for a job (default: 4 times --jobs)", type=int, default=0)
+parser.add_argument("--read-order", help="Order of the reads on each device: as walked, by inode number, or by physical position of the files (FIEMAP, costs an open() per file)",
+    choices=['walk', 'inode', 'extent'], default='inode')
+parser.add_argument("--device-jobs", help="Number of files read at once from one device (default: 1 on spinning disks, no limit otherwise)", type=int, default=0)
+parser.add_argument("--read-window", help="Number of files pulled ahead of the reads, to order them on their device", type=int, default=64)
+parser.add_argument("--read-ahead", help="MiB of files read ahead of each parsing job, while they're read and while they wait for a job",
+    type=int, default=pipeline.READ_AHEAD // (1024 * 1024))
+parser.add_argument("--progress-interval", help="Seconds between two progress reports (default: %g on a terminal, %g otherwise)" % (progress.TTY_INTERVAL, progress.LOG_INTERVAL), type=float)
 parser.add_argument("--naming", "-n", help="Specify a rom naming convention (Not yet implemented)", type=int, default=1, choices=['nointro', 'goodset'])
 parser.add_argument("--fail", help="No exceptions mangagement, break on any error", action='store_true')
 parser.add_argument("--print", "-p", help="Print a light report at the end", action='store_true')
+parser.add_argument("--output", "-o", help="Write each result as soon as it's known to this output, as format:path or a path ending with .jsonl or .csv, .gz to compress it, format:- for stdout (the messages then go to stderr) (can be repeated)",
+    action='append', default=[])
+parser.add_argument("--sqlite-batch-size", help="Number of rows written to a SQLite output between two commits", type=int, default=sinks.SQLITE_BATCH_SIZE)
+parser.add_argument("--hashes", help="Hashes to compute for each rom (default: crc md5 sha1, only crc with --fast-crc)", nargs='+', choices=['crc', 'md5', 'sha1', 'sha256'])
+parser.add_argument("--sort", help="Sort the report by file path, instead of the order the files were parsed in", action='store_true')
+parser.add_argument("--fast-crc", help="Identify archived roms from the archive directory only (name, size and CRC32), without decompressing them", action='store_true')
+parser.add_argument("--since", help="Manifest of a previous scan: only the files added or modified since are parsed, and it's updated with this scan")
+parser.add_argument("--manifest", help="Write the manifest of this scan to this file (default: update the --since manifest)")
+parser.add_argument("--verify-every", help="With --since, folders unchanged since the previous scan are not listed again, except every N scans to catch the files modified in place (0: always list them)", type=int, default=10)
+parser.add_argument("--full-verify", help="With --since, list every folder and check every file again", action='store_true')
+parser.add_argument("--resume", help="Resume an interrupted scan: the files whose results were journalled are not parsed again", action='store_true')
+parser.add_argument("--journal", help="Journal of the results of the scan, removed when the scan is complete (default: in the cache folder, one per scanned folder)")
+parser.add_argument("--checkpoint-interval", help="Seconds between two writes of the results to the journal", type=float, default=CHECKPOINT_INTERVAL)
+parser.add_argument("--watch", help="Stay running after the scan, and parse the files added or modified in the folder as they appear", action='store_true')
+parser.add_argument("--settle-time", help="Seconds a file must stay unchanged before it's parsed in watch mode, so files being copied are not parsed", type=float, default=watcher.SETTLE_TIME)
+parser.add_argument("--poll-interval", help="Seconds between two checks of the folder in watch mode, when inotify is not available", type=float, default=watcher.POLL_INTERVAL)
+parser.add_argument("--no-cache", help="Don't use the cache of the previous runs results", action='store_true')
+parser.add_argument("--rebuild-cache", help="Empty the cache of the previous runs results before filling it again", action='store_true')
+parser.add_argument("--chunk-size", help="Size in KiB of the blocks read when hashing, bounds the memory used by each job", type=int, default=CHUNK_SIZE // 1024)
+parser.add_argument("--spool-size", help="Size in MiB above which a whole extracted rom is moved from memory to a temporary file to be parsed", type=int, default=SPOOL_SIZE // (1024 * 1024))
+parser.add_argument("--spool-dir", help="Directory of the temporary files of extracted roms (default: the system temporary directory)")
+parser.add_argument("--shard", help="Only parse shard i of N of the files, split by their relative path: run N scans with i from 0 to N-1, then merge their outputs with: main.py merge -o OUTPUT SHARD_OUTPUTS...",
+    type=shards.parse_shard)
+
+# main.py merge: merge the outputs of the shards of a scan
+if __name__ == '__main__' and sys.argv[1:2] == ['merge']:
+    sys.exit(shards.main(sys.argv[2:]))
 args = parser.parse_args()
+if args.shard and args.watch:
+    parser.error("--watch can't be used with --shard, the outputs of the shards are only complete at the end of the scan")
+if args.hashes is None:
+    args.hashes = ['crc'] if args.fast_crc else ['crc', 'md5', 'sha1']
+elif args.fast_crc and set(args.hashes) != {'crc'}:
+    parser.error("--fast-crc only gives the CRC32 of the archived roms, it can't be used with --hashes %s" % ' '.join(args.hashes))
+if args.shard:
+    # The sources in the outputs are absolute, so merging finds their path relative to the root from any folder
+    args.path = os.path.abspath(args.path)
+
+"""
+Parsers of each system: the files of other systems are not even looked at
+"""
+
+SYSTEM_PARSERS = {
+    'dreamcast': (dreamcast.DreamcastParser, genericdisc.GenericDiscParser),
+    'gb': (gameboy.GameboyParser,),
+    'gba': (gba.GBAParser,),
+    'megadrive': (genesis.GensisParser, genericdisc.GenericDiscParser),
+    'mastersystem': (mastersystem.MasterSystemParser,),
+    'nes': (nes.NESParser,),
+    'n64': (nintendo64.Nintendo64Parser,),
+    'nds': (nintendods.NintendoDsParser,),
+    'saturn': (saturn.SaturnParser, genericdisc.GenericDiscParser),
+    'snes': (snes.SNESParser,),
+}
+
+# In the order they're registered, the generic ones last
+system_parsers = [p for p in RomInfoParser.getParsers() if isinstance(p, SYSTEM_PARSERS[args.system])]
+system_extensions = set(ext for p in system_parsers for ext in p.getValidExtensions())
 
-def parse_rom(rom_file: str):
+def is_system_file(name: str) -> bool:
+    # Readmes, pictures, saves... are dropped from their name alone
+    ext = os.path.splitext(name)[1][1:].lower()
+    return ext in system_extensions or ext in Archive.known_archive_extentions
+
+def parse_rom(rom_file: str, stats: dict = None):
     # Determine if the file is a supported archive or not
-    # Archive: make sure there is only one rom inside and buffer it
-    # Compute its hashes
-    my_rom = Rom(rom_file)
+    # Archive: when there are several roms inside, they're all parsed from a single decompression
+    # Compute its hashes, only once its header could be parsed
+    # The bytes its archives really decompress are counted in stats, for the progress
+    my_rom = Rom(rom_file, hashTypes = hash_types(), chunkSize = args.chunk_size * 1024,
+        spoolSize = args.spool_size * 1024 * 1024, spoolDir = args.spool_dir, stats = stats)
     cleaned_rom_name = clean_name_goodset(my_rom)
     #print(my_rom)
     real_rom = ''
     #if my_rom.archiveContent and len(my_rom.archiveContent) == 1:
-    if my_rom.isArchive() and len(my_rom.archiveContent) > 1:
-        raise ValueError("Can't determine which rom to extract from archive")
+    if args.fast_crc and my_rom.isArchive():
+        ret = scan_archive_directory(my_rom)
+        if len(ret['members']) == 1:
+            real_rom = ret['members'][0]['rom']
+    elif my_rom.isArchive() and len(my_rom.archiveContent) > 1:
+        ret = parse_archived_roms(my_rom)
     elif my_rom.isArchive():
         real_rom = list(my_rom.archiveContent[0].keys())[0]
-        rom_data = my_rom.extractRom()
-        ret = RomInfo.parseBuffer(rom_data)
+        # Only the header the parsers need is decompressed, or the whole rom if it's unknown
+        real_rom_ext = os.path.splitext(real_rom)[1][1:].lower()
+        header_size = RomInfo.getHeaderSize(real_rom_ext, system_parsers)
+        if header_size is None:
+            # The whole rom, spilled to a temporary file past --spool-size
+            with my_rom.openArchivedRom(real_rom) as spool:
+                ret = parse_spooled(spool.data, spool.path)
+        else:
+            rom_data = my_rom.readHeader(header_size)
+            ret = RomInfo.parseBuffer(rom_data, real_rom_ext if header_size else None, system_parsers)
     else:
         #print(rom_file)
-        ret = RomInfo.parse(rom_file)
+        ret = RomInfo.parse(rom_file, system_parsers)
 
     if not ret:
         raise ValueError('Unknown header')
@@ -48,10 +149,122 @@ def parse_rom(rom_file: str):
     ret['source'] = rom_file
     ret['rom'] = real_rom if real_rom else os.path.basename(rom_file)
     ret['cleaned_title'] = cleaned_rom_name
+    # Archives with several roms hold the hashes of each rom instead
+    if 'members' not in ret:
+        for hash_type in hash_types():
+            ret[hash_type] = getattr(my_rom, hash_type)
     return ret
 
+def parse_archived_roms(rom_obj: Rom) -> dict:
+    # Every rom of the archive is decompressed in the same pass, hashed and parsed from its header
+    rom_names = [m['name'] for m in rom_obj.archiveMembers if not m['name'].endswith('/') and is_system_file(m['name'])]
+    if not rom_names:
+        return {}
+    rom_exts = {name: os.path.splitext(name)[1][1:].lower() for name in rom_names}
+    header_sizes = [RomInfo.getHeaderSize(ext, system_parsers) for ext in rom_exts.values()]
+    header_size = None if None in header_sizes else max(header_sizes)
+    members = dict()
+    parsed = False
+
+    def parse_member(name: str, rom: dict):
+        # Parsed as soon as it's decompressed, so only one rom is held at a time (py7zr may call from its threads)
+        nonlocal parsed
+        if header_size is None:
+            member = parse_spooled(rom['data'], rom['path'])
+        else:
+            member = RomInfo.parseBuffer(rom['data'], rom_exts[name] if header_size else None, system_parsers)
+        parsed = parsed or bool(member)
+        member['rom'] = name
+        member['cleaned_title'] = clean_goodset_name(os.path.splitext(os.path.basename(name))[0])
+        member.update(rom['hashes'])
+        members[name] = member
+
+    rom_obj.readArchivedRoms(rom_names, header_size, parse_member)
+    if not parsed:
+        return {}
+    return {'members': [members[name] for name in rom_names if name in members]}
+
+def parse_spooled(data: bytes, path: str) -> dict:
+    # A whole rom is either still in memory, or in a temporary file named after its extension
+    if path is not None:
+        return RomInfo.parse(path, system_parsers)
+    return RomInfo.parseBuffer(bytes(data), None, system_parsers)
+
+def scan_archive_directory(rom_obj: Rom) -> dict:
+    # Everything comes from the archive directory, the roms are neither decompressed nor parsed
+    members = []
+    for member in rom_obj.listArchiveMembers():
+        if not is_system_file(member['name']):
+            continue
+        members.append({'rom': member['name'], 'size': member['size'], 'crc': member['crc'],
+            'cleaned_title': clean_goodset_name(os.path.splitext(os.path.basename(member['name']))[0])})
+    ret = {'members': members}
+    if len(members) == 1:
+        ret['crc'] = members[0]['crc']
+        ret['size'] = members[0]['size']
+    return ret
+
+def hash_types() -> tuple:
+    return tuple(args.hashes)
+
+def from_directory(file: str) -> bool:
+    # With --fast-crc, only archives are read from their directory (as Rom.isArchive() tells): other roms are still parsed in full
+    return args.fast_crc and os.path.splitext(file)[1][1:] in Archive.known_archive_extentions
+
+def read_whole(file: str) -> bool:
+    # Whether parsing reads the file end to end: an archive whose roms only need their CRC, which its
+    # directory has, is mostly read for its directory and the headers of its roms, in the parsing job
+    if os.path.splitext(file)[1][1:] in Archive.known_archive_extentions:
+        return not from_directory(file) and hash_types() != ('crc',)
+    return True
+
+def scan_mode() -> dict:
+    # What the results depend on besides the files: the results of a scan in another mode can't be reused
+    return {'system': args.system, 'hashes': list(hash_types()), 'fast_crc': args.fast_crc}
+
+def parse_rom_batch(rom_files: list) -> list:
+    # A batch travels to a worker process and back in one go, errors come back as their message
+    # along with the number of bytes decompressed for the progress
+    results = list()
+    for rom_file in rom_files:
+        stats = {'decompressed': 0}
+        try:
+            results.append((rom_file, parse_rom(rom_file, stats), None, stats['decompressed']))
+        except Exception as exc:
+            if args.fail:
+                raise
+            results.append((rom_file, None, str(exc), stats['decompressed']))
+    return results
+
+def use_processes() -> bool:
+    return args.executor == 'process' or (args.executor == 'auto' and args.jobs > 1)
+
+def io_jobs() -> int:
+    # Thread jobs already overlap their reads with each other's parsing
+    if args.io_jobs >= 0:
+        return args.io_jobs
+    return 2 if use_processes() else 0
+
+device_limits = dict()
+
+def max_per_device(device: int) -> int:
+    # Concurrent jobs seeking across one spinning disk are slower than a single one
+    if args.device_jobs:
+        return args.device_jobs
+    if device not in device_limits:
+        device_limits[device] = 1 if storage.is_rotational(device) else 0
+    return device_limits[device]
+
+def make_executor() -> concurrent.futures.Executor:
+    # Python code (parsers, py7zr, deinterleaving) holds the GIL, processes are needed to use more than one core
+    if use_processes():
+        return concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs)
+    return concurrent.futures.ThreadPoolExecutor(max_workers = args.jobs)
+
 def clean_name_goodset(rom_obj: Rom) -> str|None:
-    rom_name = rom_obj.romname
+    return clean_goodset_name(rom_obj.romname)
+
+def clean_goodset_name(rom_name: str) -> str|None:
     # We reverse the results, so the country is the last pattern we would match and replace
     # Anything before is part of the rom name
     #for matching_group in reversed(re.findall("\(.*?\)", rom_name)):
@@ -70,6 +283,9 @@ def final_output(ok_roms_list: {}):
     for rom in ok_roms_list:
         #print(rom)
         #continue
+        if 'members' in rom:
+            final_output(rom['members'])
+            continue
         print(rom['cleaned_title'], end='')
         if 'title' in rom:
             print(" - %s" % rom['title'], end='')
@@ -83,42 +299,268 @@ if __name__ == '__main__':
 
     if not os.path.exists(args.path):
         raise ValueError("Path %s doesn't exist", args.path)
+    if sinks.uses_stdout(args.output):
+        # The results are written to stdout: the messages and the progress go to stderr, not in the middle of them
+        sys.stdout = sys.stderr
 
-    # find files
-    files_list = []
-    print("Looking for files...")
-    for path, subdirs, files in os.walk(args.path):
-        for name in files:
-            files_list.append(os.path.join(path, name))
-    print("Sorting file list...")
-    files_list = sorted(files_list)
-    # print(files_list)
-    total_nb_files = len(files_list)
-    nb_parsed_files = 0
+    # Files are parsed as soon as they're found, while the walk goes on
+    nb_files = 0
+    nb_skipped_files = 0
+    nb_other_shards_files = 0
+    nb_cached_files = 0
+    nb_unchanged_files = 0
+    nb_resumed_files = 0
+    files_seen = list()
     roms_error = dict()
     roms_ok = list()
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers = args.jobs) as executor:
-        parsed_files = {executor.submit(parse_rom, file): file for file in files_list}
-        for rom in concurrent.futures.as_completed(parsed_files):
-            result = parsed_files[rom]
-            nb_parsed_files += 1
-            if args.fail:
-                data = rom.result()
+    # Files which didn't change since the previous run are taken from the cache
+    cache = None if args.no_cache else RomCache(rebuild = args.rebuild_cache, system = args.system)
+    # or carried forward from the manifest of a previous scan, without even being opened
+    previous_manifest = Manifest(args.since, scan_mode()) if args.since else None
+    if args.manifest and args.manifest != args.since:
+        new_manifest = Manifest(args.manifest, scan_mode())
+    else:
+        new_manifest = previous_manifest
+    files_stat = dict()
+    # Size and modification time of the files found, to notice their changes in watch mode
+    files_signature = dict()
+    scan_progress = progress.Progress(args.progress_interval)
+    # Results are journalled as they come, an interrupted scan resumes from there
+    # The default journal of an interrupted scan is only overwritten when it's given explicitly
+    journal_path = args.journal or default_journal_path(args.path, args.shard)
+    try:
+        journal = Journal(journal_path, resume = args.resume, checkpoint_interval = args.checkpoint_interval,
+            mode = scan_mode(), overwrite = bool(args.journal))
+    except FileExistsError:
+        parser.error("an interrupted scan of this folder left its journal in %s: resume it with --resume, "
+            "or remove it to start over" % journal_path)
+    # Results are written to the outputs as they come
+    outputs = [sinks.make_sink(spec, args.sqlite_batch_size) for spec in args.output]
+    if args.resume:
+        print("Results journalled by the interrupted scan: %d" % len(journal))
+    # Unchanged folders are not listed again, until a full verification is due
+    full_verify = not previous_manifest or args.full_verify or not args.verify_every or \
+        previous_manifest.scans_since_verify() + 1 >= args.verify_every
+    nb_unlisted_dirs = 0
+
+    def known_listing(directory: str, st: os.stat_result) -> tuple | None:
+        global nb_unlisted_dirs
+        listing = previous_manifest.get_dir(relative_path(directory), st)
+        if not listing:
+            return None
+        nb_unlisted_dirs += 1
+        on_listing(directory, st, *listing)
+        return listing[:2]
+
+    def on_listing(directory: str, st: os.stat_result, files: list, subdirs: list, nb_entries: int):
+        new_manifest.put_dir(relative_path(directory), st, files, subdirs, nb_entries)
+
+    def relative_path(file: str) -> str:
+        return os.path.relpath(file, args.path)
+
+    def record_result(file: str, data: dict | None, exc = None, from_cache = False, decompressed = 0):
+        st = files_stat.pop(file, None)
+        if from_cache:
+            scan_progress.found()
+        scan_progress.done(0 if from_cache or st is None else st.st_size, decompressed, exc is not None)
+        if args.watch and st is not None:
+            files_signature[file] = (st.st_size, st.st_mtime_ns)
+        if exc is not None:
+            print("\r%r generated an exception: %s" % (file, exc))
+            roms_error[file] = exc
+        else:
+            #print('Parsing result: \n%s' % data)
+            # should sort roms in a dict indexed with the 'title' or 'foreign_title' if it exists in the result
+            # Results are only kept for the final report
+            if args.print:
+                roms_ok.append(data)
+        if cache and not from_cache and st is not None:
+            cache.put(os.path.abspath(file), st, data, from_directory(file), exc)
+        for output in outputs:
+            output.write(file, data, exc)
+        if st is None:
+            # Couldn't even be stat'ed, there's nothing to tell it hasn't changed next time
+            return
+        if not from_cache:
+            journal.put(os.path.abspath(file), st, data, exc)
+        if new_manifest:
+            new_manifest.put(relative_path(file), st, data, exc)
+
+    def files_to_parse():
+        global nb_files, nb_skipped_files, nb_other_shards_files, nb_cached_files, nb_unchanged_files, nb_resumed_files
+        for entry in scanner.scan_files(args.path, None if full_verify else known_listing, on_listing if new_manifest else None):
+            file = entry.path
+            # Every file walked, so only the files really gone are dropped from the cache
+            files_seen.append(file)
+            if not is_system_file(entry.name):
+                nb_skipped_files += 1
+                continue
+            if args.shard and shards.shard_of(relative_path(file), args.shard[1]) != args.shard[0]:
+                nb_other_shards_files += 1
+                continue
+            nb_files += 1
+            previous = None
+            if isinstance(entry, scanner.UnlistedFile):
+                # Its folder didn't change, the file is taken as is from the previous scan
+                known = previous_manifest.known(relative_path(file))
+                if known:
+                    files_stat[file], *previous = known
+            if not previous:
+                try:
+                    files_stat[file] = entry.stat()
+                except OSError as exc:
+                    # A dangling symlink, or a file removed since its folder was listed
+                    scan_progress.found()
+                    record_result(file, None, exc)
+                    continue
+                previous = previous_manifest.get(relative_path(file), files_stat[file]) if previous_manifest else None
+            if not previous and args.resume:
+                previous = journal.get(os.path.abspath(file), files_stat[file])
+                if previous:
+                    nb_resumed_files += 1
+                    record_result(file, *previous, from_cache = True)
+                    continue
+            if previous:
+                nb_unchanged_files += 1
+                record_result(file, *previous, from_cache = True)
+                continue
+            cached = cache.get(os.path.abspath(file), files_stat[file], hash_types(), headers = not from_directory(file)) if cache else None
+            if cached:
+                nb_cached_files += 1
+                record_result(file, *cached, from_cache = True)
                 continue
-            try:
-                data = rom.result()
-            except Exception as exc:
-                print("\r%r generated an exception: %s" % (result, exc))
-                roms_error[result] = exc
+            scan_progress.found(files_stat[file].st_size)
+            yield file
+
+    print("Looking for files...")
+    try:
+        with make_executor() as executor, concurrent.futures.ThreadPoolExecutor(max_workers = max(io_jobs(), 1)) as io_executor:
+            batch_size = args.batch_size or (8 if use_processes() else 1)
+            in_flight = args.in_flight or 4 * args.jobs
+            print("Pipeline: %d I/O thread(s), %d %s job(s), %d batch(es) of %d file(s) in flight" % (io_jobs(), args.jobs,
+                'process' if use_processes() else 'thread', in_flight, batch_size))
+            files = files_to_parse()
+            # Reads are grouped by device, and ordered on each device
+            def read_position(file: str) -> tuple:
+                return storage.read_position(file, files_stat[file], args.read_order)
+            # Fast CRC scans only read the archive directories, there's nothing to read ahead
+            if io_jobs() and not args.fast_crc:
+                # The I/O threads do the reads, the parsing jobs find the files in the page cache
+                # What was read and is not parsed yet is bounded in bytes, or a few disc images would flush it:
+                # a file weighs from the moment it's read ahead until it's parsed
+                budget = pipeline.Budget(args.read_ahead * 1024 * 1024 * args.jobs)
+                def read_size(file: str) -> int:
+                    return files_stat[file].st_size if read_whole(file) else 0
+                def batch_size_bytes(batch: list) -> int:
+                    return sum(read_size(file) for file in batch)
+                files = pipeline.prefetched(io_executor, files, max(args.read_window, 2 * io_jobs()), read_position, max_per_device,
+                    read_size, budget, read_whole)
+                tasks = pipeline.run_bounded(executor, parse_rom_batch, pipeline.batched(files, batch_size), in_flight,
+                    batch_size_bytes, budget = budget, take = False)
             else:
-                #print('Parsing result: \n%s' % data)
-                # should sort roms in a dict indexed with the 'title' or 'foreign_title' if it exists in the result
-                roms_ok.append(data)
-            finally:
-                print("\rFiles parsed: %d / %d" % (nb_parsed_files, total_nb_files), end='')
+                batches = pipeline.batched_by(files, batch_size, lambda file: files_stat[file].st_dev)
+                tasks = pipeline.run_by_device(executor, parse_rom_batch, batches, lambda batch: read_position(batch[0]),
+                    max_per_device, in_flight)
+            for batch, future in tasks:
+                for result, data, exc, decompressed in future.result():
+                    record_result(result, data, exc, decompressed = decompressed)
+    except BaseException:
+        # Interrupted or failed: what was parsed so far is kept for --resume, and in the cache
+        journal.close()
+        if cache:
+            cache.close()
+        for output in outputs:
+            output.close()
+        raise
+    journal.close(remove = True)
+    if args.shard:
+        # The shard is complete: merging checks it with this summary
+        summary = {'index': args.shard[0], 'count': args.shard[1], 'root': args.path, 'files': nb_files}
+        for output in outputs:
+            output.write_summary(summary)
+    # The outputs are complete as of the scan, even if watching goes on until the process is killed
+    for output in outputs:
+        output.flush()
+    scan_progress.finish()
+    total_nb_files = nb_files
+    print("\nFiles skipped, not %s roms: %d" % (args.system, nb_skipped_files), end='')
+    if args.shard:
+        print("\nFiles of the other shards: %d" % nb_other_shards_files, end='')
+    if previous_manifest:
+        print("\nFiles unchanged since the previous scan: %d / %d" % (nb_unchanged_files, total_nb_files), end='')
+        if full_verify:
+            print("\nEvery folder was listed again (full verification)", end='')
+        else:
+            print("\nUnchanged folders not listed again: %d" % nb_unlisted_dirs, end='')
+    if args.resume:
+        print("\nFiles resumed from the journal: %d / %d" % (nb_resumed_files, total_nb_files), end='')
+    if cache:
+        print("\nFiles found in cache: %d / %d" % (nb_cached_files, total_nb_files), end='')
     print() # bring back a \n
+    if cache and not args.shard:
+        # Forget about the files which are gone since the previous run
+        # (a shard doesn't see the files of the others)
+        cache.evict(os.path.abspath(args.path), (os.path.abspath(file) for file in files_seen))
+    if previous_manifest:
+        removed_files = previous_manifest.removed(relative_path(file) for file in files_seen)
+        for removed_file in removed_files:
+            print("Removed: %s" % os.path.join(args.path, removed_file))
+            # An index which is updated scan after scan forgets about it
+            for output in outputs:
+                output.remove(os.path.join(args.path, removed_file))
+        for output in outputs:
+            output.flush()
+        print("Files removed since the previous scan: %d" % len(removed_files))
+    if new_manifest:
+        new_manifest.commit(0 if full_verify else previous_manifest.scans_since_verify() + 1)
+        new_manifest.close()
+    if previous_manifest and previous_manifest is not new_manifest:
+        previous_manifest.close()
     print("Roms not parsed: %d/%d" % (len(roms_error), total_nb_files))
 
     if args.print:
+        if args.sort:
+            roms_ok.sort(key = lambda rom: rom['source'])
         final_output(roms_ok)
+
+    if args.watch:
+        print("Watching %s for changes, Ctrl-C to stop" % args.path)
+        # Stopped by a service manager as by Ctrl-C: the cache and the outputs are closed
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            with make_executor() as executor:
+                for changed, removed in watcher.watch(args.path, files_signature, args.settle_time, args.poll_interval):
+                    changed = [file for file in changed if is_system_file(file)]
+                    for file in removed:
+                        print("Removed: %s" % file)
+                        for output in outputs:
+                            output.remove(file)
+                        if cache:
+                            cache.remove(os.path.abspath(file))
+                    batches = pipeline.batched(changed, args.batch_size or 1)
+                    for batch, future in pipeline.run_bounded(executor, parse_rom_batch, batches, args.in_flight or 4 * args.jobs):
+                        for result, data, exc, decompressed in future.result():
+                            for output in outputs:
+                                output.write(result, data, exc)
+                            if cache:
+                                try:
+                                    cache.put(os.path.abspath(result), os.stat(result), data, from_directory(result), exc)
+                                except OSError:
+                                    pass
+                            if exc is not None:
+                                print("%r generated an exception: %s" % (result, exc))
+                                continue
+                            print("Changed: %s" % result)
+                            final_output([data])
+                    for output in outputs:
+                        output.flush()
+                    if cache:
+                        cache.db.commit()
+        except KeyboardInterrupt:
+            pass
+
+    if cache:
+        cache.close()
+    for output in outputs:
+        output.close()
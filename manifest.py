@@ -0,0 +1,120 @@
+import collections
+import json
+import os
+import sqlite3
+
+"""
+Manifest of a scan: every file found below the scanned folder, with its size, its modification time
+and what its parsing gave. A later scan started with the manifest of a previous one only parses the
+files which were added or modified since, and carries the others forward without opening them.
+Paths are stored relative to the scanned folder, so a manifest still applies if the folder moves.
+
+The listed folders are recorded too, with their modification time and their entries: a folder whose
+modification time didn't change has the same entries, it's not listed again and its files are carried
+forward without even a stat(). A file modified in place doesn't change the modification time of its
+folder though, so every few scans a full verification lists and stats everything again.
+
+The results depend on how the scan was run (system, hashes, fast CRC), its mode: the files of a manifest
+written in another mode are parsed again, only its folder listings are still used.
+"""
+
+FILES_COLUMNS = "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, result TEXT, error TEXT"
+DIRS_COLUMNS = "path TEXT PRIMARY KEY, mtime_ns INTEGER, entries INTEGER, files TEXT, subdirs TEXT"
+
+# What the manifest knows of a file, in place of its os.stat_result
+FileStat = collections.namedtuple('FileStat', ['st_size', 'st_mtime_ns'])
+
+class Manifest:
+    def __init__(self, path: str, mode: dict | None = None):
+        self.path = path
+        self.mode = mode
+        self.db = sqlite3.connect(path)
+        # The previous manifest can be read while the new one is written in the same file
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (%s)" % FILES_COLUMNS)
+        self.db.execute("CREATE TABLE IF NOT EXISTS dirs (%s)" % DIRS_COLUMNS)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self.db.commit()
+        self.writing = False
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'mode'").fetchone()
+        self.same_mode = mode is None or (row is not None and json.loads(row[0]) == mode)
+
+    def close(self):
+        self.db.close()
+
+    def get(self, path: str, st: os.stat_result) -> tuple | None:
+        """
+        (result, error) of the file in this manifest, or None if it was not in the manifest or changed since.
+        """
+        known = self.known(path)
+        if not known or known[0] != (st.st_size, st.st_mtime_ns):
+            return None
+        return known[1:]
+
+    def known(self, path: str) -> tuple | None:
+        """
+        (FileStat, result, error) of the file in this manifest, or None if it's not in the manifest
+        or the manifest was written in another mode.
+        """
+        if not self.same_mode:
+            return None
+        row = self.db.execute("SELECT size, mtime_ns, result, error FROM files WHERE path = ?", (path,)).fetchone()
+        if not row:
+            return None
+        return (FileStat(row[0], row[1]), json.loads(row[2]) if row[2] is not None else None, row[3])
+
+    def get_dir(self, path: str, st: os.stat_result) -> tuple | None:
+        """
+        (files, subdirs, entries) of the folder in this manifest, or None if it was not listed or changed since.
+        """
+        row = self.db.execute("SELECT mtime_ns, files, subdirs, entries FROM dirs WHERE path = ?", (path,)).fetchone()
+        if not row or row[0] != st.st_mtime_ns:
+            return None
+        files, subdirs = json.loads(row[1]), json.loads(row[2])
+        # Where the filesystem counts the subfolders in the links of a folder, they must match too
+        if st.st_nlink >= 2 and st.st_nlink != 2 + len(subdirs):
+            return None
+        return (files, subdirs, row[3])
+
+    def put(self, path: str, st: os.stat_result | FileStat, result: dict | None, error = None):
+        self.start_writing()
+        self.db.execute("INSERT OR REPLACE INTO files_new VALUES (?, ?, ?, ?, ?)", (path, st.st_size, st.st_mtime_ns,
+            json.dumps(result, default=str) if result is not None else None, str(error) if error is not None else None))
+
+    def put_dir(self, path: str, st: os.stat_result, files: list, subdirs: list, entries: int):
+        self.start_writing()
+        self.db.execute("INSERT OR REPLACE INTO dirs_new VALUES (?, ?, ?, ?, ?)", (path, st.st_mtime_ns, entries,
+            json.dumps(files), json.dumps(subdirs)))
+
+    def start_writing(self):
+        # The new manifest is written next to the current one, which stays readable until commit()
+        if not self.writing:
+            for table, columns in (('files', FILES_COLUMNS), ('dirs', DIRS_COLUMNS)):
+                self.db.execute("DROP TABLE IF EXISTS %s_new" % table)
+                self.db.execute("CREATE TABLE %s_new (%s)" % (table, columns))
+            self.writing = True
+
+    def scans_since_verify(self) -> int:
+        # Number of scans since the last one which listed every folder
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'scans_since_verify'").fetchone()
+        return row[0] if row else 0
+
+    def removed(self, seen_paths) -> list:
+        # Files of the manifest which were not found anymore
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM seen")
+        self.db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", ((p,) for p in seen_paths))
+        return [row[0] for row in self.db.execute("SELECT path FROM files WHERE path NOT IN (SELECT path FROM seen) ORDER BY path")]
+
+    def commit(self, scans_since_verify: int = 0):
+        # The manifest of this scan replaces the previous one
+        self.start_writing()
+        for table in ('files', 'dirs'):
+            self.db.execute("DROP TABLE %s" % table)
+            self.db.execute("ALTER TABLE %s_new RENAME TO %s" % (table, table))
+        self.writing = False
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('scans_since_verify', ?)", (scans_since_verify,))
+        if self.mode is not None:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('mode', ?)", (json.dumps(self.mode),))
+            self.same_mode = True
+        self.db.commit()
@@ -0,0 +1,180 @@
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import threading
+
+"""
+Stages of a scan: the files found by the walk go through a small pool of I/O threads which read them
+ahead, then to the CPU pool which parses and hashes them, and the results come back to the main
+thread. The queues between the stages are bounded, so a fast stage can't run away from a slow one.
+They're bounded in bytes too: a few disc images weigh more than thousands of cartridge roms.
+"""
+
+CHUNK_SIZE = 1024 * 1024
+# Bytes of files read ahead of each parsing job, in each stage
+READ_AHEAD = 64 * 1024 * 1024
+
+class Budget:
+    """
+    Weight of the items between the stages of a scan, shared so an item is counted once from the stage
+    where it's taken (read ahead) to the one where it's given back (parsed). An item heavier than the
+    rest of the budget waits for the weight the last stage is giving back, if there is any: else it goes
+    anyway, so a single heavy item, or a partial batch, can't block the pipeline.
+    """
+    def __init__(self, max_weight: int = 0):
+        self.max_weight = max_weight
+        self.weight = 0
+        # Weight of the submitted tasks which give it back when they complete
+        self.returning = 0
+        self.condition = threading.Condition()
+
+    def fits(self, weight: int) -> bool:
+        return self.weight == 0 or self.weight + weight <= self.max_weight or self.max_weight <= 0
+
+    def take(self, weight: int):
+        with self.condition:
+            while not self.fits(weight) and self.returning:
+                self.condition.wait()
+            self.weight += weight
+
+    def submitted(self, future: concurrent.futures.Future, weight: int):
+        with self.condition:
+            self.returning += weight
+        future.add_done_callback(lambda future: self.give_back(weight))
+
+    def give_back(self, weight: int):
+        with self.condition:
+            self.weight -= weight
+            self.returning -= weight
+            self.condition.notify_all()
+
+def run_bounded(executor: concurrent.futures.Executor, fn, items, max_in_flight: int, weight = None, max_weight: int = 0,
+        budget: Budget = None, take = True, give_back = True):
+    """
+    Submit fn(item) for every item, with at most max_in_flight tasks pending at any time, and yield
+    (item, future) as the tasks complete. Items are only pulled when there is room for them.
+    With max_weight, the pending items also weigh at most that in total (weight(item), their size
+    for example), except for a single item heavier than that on its own.
+    A budget shared with other stages replaces max_weight: the stage takes the weight of its items
+    and/or gives it back once their task completes.
+    """
+    if budget is None:
+        budget = Budget(max_weight)
+    weighed = budget.max_weight > 0 and weight is not None
+    in_flight = dict()
+    for item in items:
+        item_weight = weight(item) if weighed else 0
+        while in_flight and (len(in_flight) >= max_in_flight or (take and not budget.fits(item_weight))):
+            done, _ = concurrent.futures.wait(in_flight, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future
+        if take:
+            budget.take(item_weight)
+        future = executor.submit(fn, item)
+        if give_back:
+            budget.submitted(future, item_weight)
+        in_flight[future] = item
+    for future in concurrent.futures.as_completed(in_flight):
+        yield in_flight[future], future
+
+def run_by_device(executor: concurrent.futures.Executor, fn, items, place, max_per_device, max_in_flight: int,
+        weight = None, max_weight: int = 0, budget: Budget = None, take = True, give_back = True):
+    """
+    Like run_bounded(), for items stored on several devices: place(item) gives its (device, position),
+    and max_per_device(device) how many of its tasks can run at once. Up to max_in_flight items are
+    pulled ahead, and the waiting items of a device are submitted by increasing position.
+    The weight only bounds the submitted items, the waiting ones weigh nothing yet.
+    """
+    if budget is None:
+        budget = Budget(max_weight)
+    weighed = budget.max_weight > 0 and weight is not None
+    waiting = collections.defaultdict(list)
+    running = collections.Counter()
+    in_flight = dict()
+    # Ties in position keep the order of the items
+    order = itertools.count()
+    items = iter(items)
+    exhausted = False
+    nb_waiting = 0
+    while True:
+        while not exhausted and nb_waiting + len(in_flight) < max_in_flight:
+            item = next(items, None)
+            if item is None:
+                exhausted = True
+                break
+            device, position = place(item)
+            heapq.heappush(waiting[device], (position, next(order), weight(item) if weighed else 0, item))
+            nb_waiting += 1
+        for device, queue in waiting.items():
+            limit = max_per_device(device) or max_in_flight
+            while queue and running[device] < limit:
+                if take and in_flight and not budget.fits(queue[0][2]):
+                    break
+                item_weight, item = heapq.heappop(queue)[2:]
+                nb_waiting -= 1
+                running[device] += 1
+                if take:
+                    budget.take(item_weight)
+                future = executor.submit(fn, item)
+                if give_back:
+                    budget.submitted(future, item_weight)
+                in_flight[future] = (item, device)
+        if not in_flight:
+            break
+        done, _ = concurrent.futures.wait(in_flight, return_when = concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            item, device = in_flight.pop(future)
+            running[device] -= 1
+            yield item, future
+
+def batched(items, size: int):
+    batch = list()
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
+
+def batched_by(items, size: int, key):
+    """
+    Batches of items with the same key(item): a batch doesn't mix files of several devices.
+    """
+    batches = dict()
+    for item in items:
+        batch = batches.setdefault(key(item), list())
+        batch.append(item)
+        if len(batch) == size:
+            yield batches.pop(key(item))
+    yield from batches.values()
+
+def prefetch_file(path: str) -> int:
+    """
+    Read a file through once, so it's in the page cache when a parsing job opens it: slow reads then
+    happen in the I/O threads instead of blocking a CPU worker. Returns the number of bytes read.
+    """
+    size = 0
+    buffer = bytearray(CHUNK_SIZE)
+    with open(path, 'rb', buffering=0) as f:
+        while read := f.readinto(buffer):
+            size += read
+    return size
+
+def prefetched(executor: concurrent.futures.Executor, items, max_in_flight: int, place = None, max_per_device = None,
+        weight = None, budget: Budget = None, wanted = None):
+    """
+    Yield the items once they're read ahead, taking their weight from the budget: the stage which
+    parses them gives it back. Only the items wanted(item) are read, the others just go through.
+    """
+    def read(item) -> int:
+        # Failures are left to the parsing stage, which reports them
+        return prefetch_file(item) if wanted is None or wanted(item) else 0
+    if place:
+        tasks = run_by_device(executor, read, items, place, max_per_device, max_in_flight, weight, budget = budget,
+            give_back = False)
+    else:
+        tasks = run_bounded(executor, read, items, max_in_flight, weight, budget = budget, give_back = False)
+    for item, future in tasks:
+        yield item
@@ -0,0 +1,69 @@
+import datetime
+import sys
+import time
+
+"""
+Progress of a scan, reported at a fixed rate whatever the number of files: on a terminal a single line
+is updated in place a few times per second, otherwise a log line is printed every few seconds.
+The estimated time left is based on the bytes left to read, the walk may not be over yet though.
+The read rate is an estimate too, the sizes of the files parsed: only the header and the directory of
+an archive may be read, and the page cache may hold a file already. The decompressed rate counts the
+bytes the archives really gave.
+"""
+
+TTY_INTERVAL = 0.2
+LOG_INTERVAL = 10.0
+MB = 1000 * 1000
+
+class Progress:
+    def __init__(self, interval: float | None = None, stream = None):
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty()
+        self.interval = interval or (TTY_INTERVAL if self.tty else LOG_INTERVAL)
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.files_found = 0
+        self.files_done = 0
+        self.errors = 0
+        self.bytes_queued = 0
+        self.bytes_read = 0
+        self.bytes_decompressed = 0
+
+    def found(self, size: int = 0):
+        # size: bytes to read for this file, 0 if its result is already known
+        self.files_found += 1
+        self.bytes_queued += size
+
+    def done(self, size: int = 0, decompressed: int = 0, error: bool = False):
+        # size: the size of the file parsed, decompressed: the bytes decompressed from it
+        self.files_done += 1
+        self.bytes_read += size
+        self.bytes_decompressed += decompressed
+        if error:
+            self.errors += 1
+        self.update()
+
+    def update(self):
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now: float, end: str | None = None):
+        elapsed = max(now - self.start, 1e-6)
+        byte_rate = self.bytes_read / elapsed
+        eta = '?'
+        if byte_rate:
+            eta = str(datetime.timedelta(seconds = round(max(self.bytes_queued - self.bytes_read, 0) / byte_rate)))
+        line = "Files parsed: %d / %d | %.1f files/s | read ~%.1f MB/s | decompressed %.1f MB/s | errors: %d | ETA %s" % (
+            self.files_done, self.files_found, self.files_done / elapsed, byte_rate / MB,
+            self.bytes_decompressed / elapsed / MB, self.errors, eta)
+        if self.tty:
+            # Clear the end of a longer previous line
+            print("\r%s\x1b[K" % line, end='' if end is None else end, file=self.stream, flush=True)
+        else:
+            print(line, end='\n' if end is None else end, file=self.stream, flush=True)
+
+    def finish(self):
+        # The last report, the summary goes on right after it
+        self.report(time.monotonic(), end='')
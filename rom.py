@@ -4,9 +4,36 @@ import os
 import py7zr
 import zipfile
 
+from archive import CHUNK_SIZE, SPOOL_SIZE, Archive, Spool
+
+class Hasher:
+	# Feed every requested digest from a single read of the data
+	def __init__(self, hashTypes = ('crc', 'md5', 'sha1')):
+		self.crc = 0 if 'crc' in hashTypes else None
+		self.digests = {h: hashlib.new(h) for h in hashTypes if h in ['md5', 'sha1', 'sha256']}
+
+	def update(self, chunk):
+		if self.crc is not None:
+			self.crc = binascii.crc32(chunk, self.crc)
+		for digest in self.digests.values():
+			digest.update(chunk)
+
+	def updateFromStream(self, stream, chunkSize = CHUNK_SIZE):
+		while chunk := stream.read(chunkSize):
+			self.update(chunk)
+		return self
+
+	def hexdigests(self) -> dict:
+		hashes = {h: digest.hexdigest() for h, digest in self.digests.items()}
+		if self.crc is not None:
+			hashes['crc'] = "%08x" % (self.crc & 0xFFFFFFFF)
+		return hashes
+
 class Rom:
 	# rom must be a fullpath to an existing rom file
-	def __init__(self, rom: str, crc = '', filecrc = ''):
+	# Hashes are only computed when one of them is read, all the hashTypes in a single pass
+	def __init__(self, rom: str, crc = '', filecrc = '', hashTypes = ('crc', 'md5', 'sha1'), chunkSize = CHUNK_SIZE, headerSize: int | None = 0, spoolSize = SPOOL_SIZE, spoolDir = None,
+			stats: dict | None = None):
 		if not os.path.exists(rom):
 			raise Exception(rom + " doesn't exist")
 		self.rompathname = rom
@@ -14,116 +41,263 @@ class Rom:
 		self.romfile = os.path.basename(rom)
 		self.romname = os.path.splitext(self.romfile)[0]
 		self.romext = os.path.splitext(rom)[1][1:]
-		self.crc = crc
-		self.md5 = None
-		self.sha1 = None
+		self.hashes = {'crc': crc} if crc else {}
 		self.filecrc = filecrc
+		self.hashTypes = hashTypes
+		self.chunkSize = chunkSize
+		# Leading bytes of the archived rom kept while it's hashed, None keeps the whole file
+		self.headerSize = headerSize
+		# Whole archived roms stay in memory up to spoolSize bytes, then go to a temporary file in spoolDir
+		self.spoolSize = spoolSize
+		self.spoolDir = spoolDir
+		# What its archives decompress, stats['decompressed'] bytes
+		self.stats = stats if stats is not None else {}
 		self.archiveContent = []
+		self.archiveMembers = []
+		self.archiveData = {}
 		self.isoExtensions = ['iso', 'cue', 'chd']
 		self.known_archive_extentions = ['zip', '7z']
-		self.getCRC()
-		self.getMD5()
-		self.getSHA1()
+		self.listArchive()
 
+	# Only the hashes already computed are shown: printing a rom doesn't read it
 	def __repr__(self):
-		return "Rom('{}', crc = '{}', filecrc = '{}')".format(self.rompathname, self.crc, self.filecrc)
+		return "Rom('{}', crc = '{}', filecrc = '{}')".format(self.rompathname, self.hashes.get('crc', ''), self.filecrc)
 
 	def __str__(self):
-		return "Rom: {}\nSplit into {} / {} . {}\nHashes:\n  - CRC: {}\n  - MD5: {}\n  - SHA1: {}\nFile content:: {}".format(self.rompathname, self.rompath, self.romfile, self.romext, self.crc, self.md5, self.sha1, self.archiveContent)
+		return "Rom: {}\nSplit into {} / {} . {}\nHashes:\n  - CRC: {}\n  - MD5: {}\n  - SHA1: {}\n  - SHA256: {}\nFile content:: {}".format(self.rompathname, self.rompath, self.romfile, self.romext, self.hashes.get('crc'), self.hashes.get('md5'), self.hashes.get('sha1'), self.hashes.get('sha256'), self.archiveContent)
+
+	@property
+	def crc(self) -> str | None:
+		return self.getHash('crc')
+
+	@property
+	def md5(self) -> str | None:
+		return self.getHash('md5')
+
+	@property
+	def sha1(self) -> str | None:
+		return self.getHash('sha1')
+
+	@property
+	def sha256(self) -> str | None:
+		return self.getHash('sha256')
+
+	def getHash(self, hashType: str) -> str | None:
+		if hashType not in self.hashes:
+			self.computeHashes(set(self.hashTypes) | {hashType})
+		return self.hashes.get(hashType)
+
+	def isSingleFileArchive(self) -> bool:
+		return self.isArchive() and len(self.archiveContent) == 1
+
+	def computeHashes(self, hashTypes = None) -> dict:
+		# Read the rom (or its single archived file) once, and feed all the missing digests with it
+		hashTypes = [h for h in (hashTypes or self.hashTypes) if h not in self.hashes]
+		if self.isSingleFileArchive():
+			fileName = list(self.archiveContent[0].keys())[0]
+			# The archive already knows the CRC of its content
+			if 'crc' in hashTypes:
+				self.hashes['crc'] = list(self.archiveContent[0].values())[0].zfill(8)
+				hashTypes.remove('crc')
+			if hashTypes:
+				hasher = Hasher(hashTypes)
+				with self.openArchive() as archive:
+					self.archiveData[fileName] = archive.readMember(fileName, hasher, self.headerSize)
+				self.hashes.update(hasher.hexdigests())
+		elif hashTypes:
+			hashes = self.hashFile(Hasher(hashTypes)).hexdigests()
+			if 'crc' in hashes:
+				self.filecrc = hashes['crc']
+			self.hashes.update(hashes)
+		return self.hashes
+
+	def hashFile(self, hasher: Hasher) -> Hasher:
+		with open(self.rompathname, 'rb') as f:
+			return hasher.updateFromStream(f, self.chunkSize)
+
+	def hashArchivedFile(self, archiveFile: str, hasher: Hasher) -> Hasher:
+		# Only one chunk of the file is in memory at a time, whatever its size
+		with self.openArchive() as archive:
+			archive.readMember(archiveFile, hasher, 0)
+		return hasher
+
+	def openArchive(self) -> Archive:
+		return Archive(self.rompathname, self.romext, self.chunkSize, self.stats)
 
 	def getCRC(self) -> str |None:
-		if self.crc:
-			return self.crc
-		self.listArchive()
-		if self.isArchive() and len(self.archiveContent) == 1:
-			self.crc = list(self.archiveContent[0].values())[0].zfill(8)
-		elif self.isArchive():
-			self.crc = self.fileCRC()
-		else:
-			self.crc = self.fileCRC()
 		return self.crc
 
 	def fileCRC(self) -> str:
-		buf = open(self.rompathname, 'rb').read()
-		self.filecrc = self.compute_hash(buf, 'crc')
+		self.filecrc = self.hashFile(Hasher(['crc'])).hexdigests()['crc']
 		return self.filecrc
 
 	def isArchive(self) -> bool:
 		return self.romext in self.known_archive_extentions
 
 	def listArchiveFromZip(self) -> list:
-		filesList = []
-		with zipfile.ZipFile(self.rompathname) as romzip:
-			zipinfodata = romzip.infolist()
-			for f in zipinfodata:
-				decimalCRC = romzip.getinfo(f.filename).CRC
-				filesList.append({f.filename: f'{decimalCRC:x}'})
-		return filesList
+		with self.openArchive() as archive:
+			return archive.list()
 
 	def listArchiveFrom7z(self) -> list:
-		filesList = []
-		with py7zr.SevenZipFile(self.rompathname, 'r') as romzip:
-			zipinfodata = romzip.list()
-			for f in zipinfodata:
-				decimalCRC = zipinfodata[0].crc32
-				filesList.append({f.filename: f'{decimalCRC:x}'})
-		return filesList
+		with self.openArchive() as archive:
+			return archive.list()
 
 	def listArchive(self) -> list | None:
 		if self.romext not in ['7z', 'zip']:
 			return None
-		if self.romext == 'zip':
-			self.archiveContent = self.listArchiveFromZip()
-		if self.romext == '7z':
-			self.archiveContent = self.listArchiveFrom7z()
+		# A single read of the archive directory gives both the content and the members details
+		with self.openArchive() as archive:
+			self.archiveMembers = archive.members()
+		self.archiveContent = [{m['name']: m['crc'].lstrip('0') or '0'} for m in self.archiveMembers]
+
+	def listArchiveMembers(self) -> list:
+		return self.archiveMembers
 
-	def extractFileFromZip(self, archiveFile: str, destinationPath = '/tmp'):
+	def extractFileFromZip(self, archiveFile: str, destinationPath = None):
 		if not destinationPath:
-			return zipfile.ZipFile(self.rompathname).read(archiveFile)
+			with self.openArchive() as archive:
+				return archive.readMember(archiveFile)
 		with zipfile.ZipFile(self.rompathname) as romzip:
 			outputFile = romzip.extract(archiveFile, destinationPath)
 			return outputFile
 
-	def extractFileFrom7z(self, archiveFile: str, destinationPath = '/tmp'):
+	def extractFileFrom7z(self, archiveFile: str, destinationPath = None):
 		if not destinationPath:
-			return py7zr.SevenZipFile(self.rompathname).read([archiveFile])[archiveFile].getvalue()
+			with self.openArchive() as archive:
+				return archive.readMember(archiveFile)
 		with py7zr.SevenZipFile(self.rompathname, 'r') as romzip:
-			romzip.extract(destinationPath, archiveFile)
+			romzip.extract(destinationPath, [archiveFile])
 			return "{}/{}".format(destinationPath, archiveFile)
 
 	def extractRom(self, fileName=None, path=''):
 		extractedFileLocation = None
 		if not fileName:
 			fileName = list(self.archiveContent[0].keys())[0]
+		# The whole file is decompressed once, and hashed at the same time
+		if not path and self.headerSize is None and self.isSingleFileArchive():
+			if fileName not in self.archiveData:
+				self.computeHashes()
+			if fileName in self.archiveData:
+				return self.archiveData[fileName]
 		if self.romext == 'zip':
 			extractedFileLocation = self.extractFileFromZip(fileName, path)
 		if self.romext == '7z':
 			extractedFileLocation = self.extractFileFrom7z(fileName, path)
 		return extractedFileLocation
 
+	def readArchivedRoms(self, fileNames = None, keepSize: int | None = 0, onRom = None) -> dict:
+		"""
+		Decompress several archived roms in a single pass, hashing each of them while it streams out.
+		In a solid 7z block, extracting the files one by one would decompress again everything stored
+		before each of them. Returns the hashes and the first keepSize bytes of every file.
+		With onRom, each file is given to onRom(fileName, rom) as soon as it's complete instead of
+		being returned. A whole file (keepSize None) is then only held until it's handled: in memory
+		as rom['data'] up to spoolSize bytes, past that in the temporary file rom['path'] (and 'data'
+		is None), removed once onRom returns.
+		"""
+		if fileNames is None:
+			fileNames = [m['name'] for m in self.archiveMembers]
+		crcs = {m['name']: m['crc'] for m in self.archiveMembers}
+		hashTypes = [h for h in self.hashTypes if h != 'crc']
+		hashers = {fileName: Hasher(hashTypes) if hashTypes else None for fileName in fileNames}
+		spools = {}
+		if keepSize is None:
+			spools = {fileName: Spool(os.path.splitext(fileName)[1], self.spoolSize, self.spoolDir) for fileName in fileNames}
+		roms = {}
+		collect = onRom is None
+		if collect:
+			onRom = roms.__setitem__
+
+		def onMember(fileName: str, data: bytes):
+			hashes = hashers[fileName].hexdigests() if hashers[fileName] else {}
+			# The archive already knows the CRC of its content
+			if 'crc' in self.hashTypes:
+				hashes['crc'] = crcs[fileName]
+			rom = {'hashes': hashes, 'data': data, 'path': None}
+			spool = spools.get(fileName)
+			if spool is not None:
+				try:
+					spool.finish()
+					if collect:
+						rom['data'] = spool.read()
+					else:
+						rom['data'] = spool.data if spool.path is None else None
+						rom['path'] = spool.path
+					onRom(fileName, rom)
+				finally:
+					spool.close()
+			else:
+				onRom(fileName, rom)
+
+		try:
+			with self.openArchive() as archive:
+				archive.readMembers(hashers, 0 if spools else keepSize, onMember, spools)
+		finally:
+			# Left by an extraction which failed
+			for spool in spools.values():
+				spool.close()
+		return roms
+
+	def readHeader(self, size: int | None, fileName = None) -> bytes:
+		# Only decompress the first bytes of an archived rom, a header parser doesn't need more
+		if not fileName:
+			fileName = list(self.archiveContent[0].keys())[0]
+		if size is None:
+			return self.readArchivedRom(fileName)
+		if fileName in self.archiveData and (self.headerSize is None or self.headerSize >= size):
+			return self.archiveData[fileName][:size]
+		with self.openArchive() as archive:
+			return archive.readMember(fileName, None, size)
+
+	def readArchivedRom(self, fileName: str) -> bytes:
+		# The whole rom in memory, whatever its size: openArchivedRom() bounds it
+		with self.openArchivedRom(fileName) as spool:
+			return spool.read()
+
+	def openArchivedRom(self, fileName = None) -> Spool:
+		"""
+		Decompress a whole archived rom into a Spool, which must be closed by the caller: in memory
+		up to spoolSize bytes, in a temporary file a parser can open by its path past that. The
+		single rom of an archive is hashed during the same decompression if its hashes are still missing.
+		"""
+		if not fileName:
+			fileName = list(self.archiveContent[0].keys())[0]
+		hasher = None
+		if self.isSingleFileArchive():
+			self.computeHashes(['crc'] if 'crc' in self.hashTypes else [])
+			hashTypes = [h for h in self.hashTypes if h not in self.hashes]
+			hasher = Hasher(hashTypes) if hashTypes else None
+		spool = Spool(os.path.splitext(fileName)[1], self.spoolSize, self.spoolDir)
+		try:
+			with self.openArchive() as archive:
+				archive.readMembers({fileName: hasher}, 0, None, {fileName: spool})
+			spool.finish()
+		except BaseException:
+			spool.close()
+			raise
+		if hasher:
+			self.hashes.update(hasher.hexdigests())
+		return spool
+
 	def getMD5orSHA1(self, hashType) -> str | None:
 		if hashType not in ['md5', 'sha1']:
 			return None
 
 		if self.isArchive() and len(self.archiveContent) != 1:
-			file_data = open(self.rompathname,'rb').read()
+			hasher = self.hashFile(Hasher([hashType]))
 		elif self.isArchive() and len(self.archiveContent) == 1:
-			file_data = self.extractRom()
+			hasher = self.hashArchivedFile(list(self.archiveContent[0].keys())[0], Hasher([hashType]))
 		elif not self.isArchive():
-			file_data = open(self.rompathname,'rb').read()
+			hasher = self.hashFile(Hasher([hashType]))
 		else:
 			# This case should never happen, but the most obvious reason is an unvalid archive
 			raise Exception('Not a valid file')
-		return self.compute_hash(file_data, hashType)
+		return hasher.hexdigests()[hashType]
 
 	def getMD5(self):
-		if not self.md5:
-			self.md5 = self.getMD5orSHA1('md5')
 		return self.md5
 
 	def getSHA1(self):
-		if not self.sha1:
-			self.sha1 = self.getMD5orSHA1('sha1')
 		return self.sha1
 
 	def compute_hash(self, buffer, hash_type:str) -> str:
@@ -0,0 +1,69 @@
+import os
+
+"""
+Walk a roms folder with os.scandir, yielding the files as they're found so their parsing can start
+while the walk goes on. The directory entries carry their stat result, no extra stat is needed.
+"""
+
+class UnlistedFile:
+    """
+    File of a folder which was not listed again because it didn't change since the previous scan.
+    Like an os.DirEntry, but nothing is known about it besides its path until stat() is called.
+    """
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self) -> bool:
+        return False
+
+    def stat(self) -> os.stat_result:
+        return os.stat(self.path)
+
+def scan_files(path: str, known_listing = None, on_listing = None):
+    """
+    Yield an os.DirEntry for every file below path. Entries are yielded in the order the filesystem
+    lists them: sorting is left to the output.
+    With known_listing(directory, st) returning the (files, subdirs) names of a folder that didn't
+    change, the folder is not listed again: an UnlistedFile is yielded for each of its files, and
+    its subfolders are still visited as their changes don't show in the folder modification time.
+    on_listing(directory, st, files, subdirs, nb_entries) is called after a folder was listed.
+    """
+    pending = [path]
+    while pending:
+        directory = pending.pop()
+        st = None
+        if known_listing or on_listing:
+            try:
+                # Before the listing: a change during the listing makes the next scan list it again
+                st = os.stat(directory)
+            except OSError:
+                continue
+        listing = known_listing(directory, st) if known_listing else None
+        if listing:
+            files, subdirs = listing
+            for name in files:
+                yield UnlistedFile(directory, name)
+            pending.extend(os.path.join(directory, name) for name in reversed(subdirs))
+            continue
+        try:
+            with os.scandir(directory) as entries:
+                files = []
+                subdirs = []
+                nb_entries = 0
+                for entry in entries:
+                    nb_entries += 1
+                    if entry.is_dir():
+                        # Symbolic links to folders are not followed, like os.walk() does
+                        if not entry.is_symlink():
+                            subdirs.append(entry.name)
+                    else:
+                        files.append(entry.name)
+                        yield entry
+        except OSError:
+            # Unreadable folders are skipped, like os.walk() does
+            continue
+        if on_listing:
+            on_listing(directory, st, files, subdirs, nb_entries)
+        # Depth first, so the files of one folder are parsed close to each other
+        pending.extend(os.path.join(directory, name) for name in reversed(subdirs))
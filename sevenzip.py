@@ -0,0 +1,335 @@
+import binascii
+import lzma
+import struct
+
+"""
+Read the list of the files stored in a 7z archive from its header only.
+The header (possibly compressed as an "encoded header") is at the end of the archive: only the
+signature header and this block are read, no pack stream is ever decompressed.
+Format reference: 7zFormat.txt from the 7-Zip / p7zip sources.
+"""
+
+SIGNATURE = b'7z\xbc\xaf\x27\x1c'
+SIGNATURE_HEADER_SIZE = 32
+
+# Property IDs
+kEnd = 0x00
+kHeader = 0x01
+kArchiveProperties = 0x02
+kAdditionalStreamsInfo = 0x03
+kMainStreamsInfo = 0x04
+kFilesInfo = 0x05
+kPackInfo = 0x06
+kUnPackInfo = 0x07
+kSubStreamsInfo = 0x08
+kSize = 0x09
+kCRC = 0x0a
+kFolder = 0x0b
+kCodersUnPackSize = 0x0c
+kNumUnPackStream = 0x0d
+kEmptyStream = 0x0e
+kEmptyFile = 0x0f
+kName = 0x11
+kEncodedHeader = 0x17
+kDummy = 0x19
+
+# Codecs an encoded header can be compressed with
+COPY = b'\x00'
+LZMA = b'\x03\x01\x01'
+LZMA2 = b'\x21'
+
+class SevenZipHeaderError(Exception):
+	pass
+
+class HeaderReader:
+	# Cursor over a header block
+	def __init__(self, data: bytes):
+		self.data = data
+		self.pos = 0
+
+	def byte(self) -> int:
+		if self.pos >= len(self.data):
+			raise SevenZipHeaderError('Truncated header')
+		self.pos += 1
+		return self.data[self.pos - 1]
+
+	def bytes(self, size: int) -> bytes:
+		if self.pos + size > len(self.data):
+			raise SevenZipHeaderError('Truncated header')
+		self.pos += size
+		return self.data[self.pos - size:self.pos]
+
+	def uint32(self) -> int:
+		return struct.unpack('<I', self.bytes(4))[0]
+
+	def number(self) -> int:
+		# 7z variable length integer: the leading 1 bits of the first byte count the extra bytes
+		first = self.byte()
+		mask = 0x80
+		value = 0
+		for i in range(8):
+			if first & mask == 0:
+				return value | ((first & (mask - 1)) << (8 * i))
+			value |= self.byte() << (8 * i)
+			mask >>= 1
+		return value
+
+	def bits(self, count: int) -> list:
+		bits = []
+		current = 0
+		for i in range(count):
+			if i % 8 == 0:
+				current = self.byte()
+			bits.append(bool(current & (0x80 >> (i % 8))))
+		return bits
+
+	def definedBits(self, count: int) -> list:
+		# "AllAreDefined" byte, followed by a bit vector when it's 0
+		if self.byte():
+			return [True] * count
+		return self.bits(count)
+
+	def digests(self, count: int) -> list:
+		defined = self.definedBits(count)
+		return [self.uint32() if d else None for d in defined]
+
+	def expect(self, propertyId: int):
+		if self.byte() != propertyId:
+			raise SevenZipHeaderError('Unexpected property in header')
+
+class Folder:
+	def __init__(self):
+		self.coders = []
+		self.bindPairs = []
+		self.packedStreams = []
+		self.unpackSizes = []
+		self.crc = None
+		self.numUnpackStreams = 1
+
+	def unpackSize(self) -> int:
+		# The output stream which is not bound to another coder is the folder output
+		bound = {outIndex for inIndex, outIndex in self.bindPairs}
+		for i, size in enumerate(self.unpackSizes):
+			if i not in bound:
+				return size
+		return 0
+
+def readFolder(reader: HeaderReader) -> Folder:
+	folder = Folder()
+	numInStreams = 0
+	numOutStreams = 0
+	for i in range(reader.number()):
+		flags = reader.byte()
+		coder = {'id': reader.bytes(flags & 0x0f), 'properties': b''}
+		if flags & 0x10:
+			coder['inStreams'] = reader.number()
+			coder['outStreams'] = reader.number()
+		else:
+			coder['inStreams'] = coder['outStreams'] = 1
+		if flags & 0x20:
+			coder['properties'] = reader.bytes(reader.number())
+		numInStreams += coder['inStreams']
+		numOutStreams += coder['outStreams']
+		folder.coders.append(coder)
+	for i in range(numOutStreams - 1):
+		folder.bindPairs.append((reader.number(), reader.number()))
+	numPackedStreams = numInStreams - len(folder.bindPairs)
+	if numPackedStreams == 1:
+		bound = {inIndex for inIndex, outIndex in folder.bindPairs}
+		folder.packedStreams = [i for i in range(numInStreams) if i not in bound][:1]
+	else:
+		folder.packedStreams = [reader.number() for i in range(numPackedStreams)]
+	return folder
+
+def readPackInfo(reader: HeaderReader) -> dict:
+	packInfo = {'packPos': reader.number(), 'sizes': [], 'crcs': []}
+	numPackStreams = reader.number()
+	while (propertyId := reader.byte()) != kEnd:
+		if propertyId == kSize:
+			packInfo['sizes'] = [reader.number() for i in range(numPackStreams)]
+		elif propertyId == kCRC:
+			packInfo['crcs'] = reader.digests(numPackStreams)
+		else:
+			raise SevenZipHeaderError('Unexpected property in pack info')
+	return packInfo
+
+def readUnpackInfo(reader: HeaderReader) -> list:
+	reader.expect(kFolder)
+	numFolders = reader.number()
+	if reader.byte():
+		raise SevenZipHeaderError('External folders are not supported')
+	folders = [readFolder(reader) for i in range(numFolders)]
+	reader.expect(kCodersUnPackSize)
+	for folder in folders:
+		numOutStreams = sum(coder['outStreams'] for coder in folder.coders)
+		folder.unpackSizes = [reader.number() for i in range(numOutStreams)]
+	while (propertyId := reader.byte()) != kEnd:
+		if propertyId == kCRC:
+			for folder, crc in zip(folders, reader.digests(numFolders)):
+				folder.crc = crc
+		else:
+			raise SevenZipHeaderError('Unexpected property in unpack info')
+	return folders
+
+def readSubStreamsInfo(reader: HeaderReader, folders: list) -> list:
+	# Returns a (size, crc) tuple for each file stored in the folders
+	propertyId = reader.byte()
+	if propertyId == kNumUnPackStream:
+		for folder in folders:
+			folder.numUnpackStreams = reader.number()
+		propertyId = reader.byte()
+	sizes = []
+	for folder in folders:
+		if folder.numUnpackStreams == 0:
+			continue
+		folderSizes = []
+		if propertyId == kSize:
+			folderSizes = [reader.number() for i in range(folder.numUnpackStreams - 1)]
+		folderSizes.append(folder.unpackSize() - sum(folderSizes))
+		sizes.append(folderSizes)
+	if propertyId == kSize:
+		propertyId = reader.byte()
+	# Only the streams whose CRC isn't already known from their folder get a digest here
+	crcs = []
+	numDigests = sum(f.numUnpackStreams for f in folders if not (f.numUnpackStreams == 1 and f.crc is not None))
+	digests = []
+	while propertyId != kEnd:
+		if propertyId == kCRC:
+			digests = reader.digests(numDigests)
+		else:
+			raise SevenZipHeaderError('Unexpected property in substreams info')
+		propertyId = reader.byte()
+	digests = iter(digests or [None] * numDigests)
+	for folder in folders:
+		if folder.numUnpackStreams == 1 and folder.crc is not None:
+			crcs.append([folder.crc])
+		elif folder.numUnpackStreams:
+			crcs.append([next(digests) for i in range(folder.numUnpackStreams)])
+	streams = []
+	for folderSizes, folderCrcs in zip(sizes, crcs):
+		streams.extend(zip(folderSizes, folderCrcs))
+	return streams
+
+def readStreamsInfo(reader: HeaderReader) -> dict:
+	streamsInfo = {'packInfo': None, 'folders': [], 'streams': None}
+	while (propertyId := reader.byte()) != kEnd:
+		if propertyId == kPackInfo:
+			streamsInfo['packInfo'] = readPackInfo(reader)
+		elif propertyId == kUnPackInfo:
+			streamsInfo['folders'] = readUnpackInfo(reader)
+		elif propertyId == kSubStreamsInfo:
+			streamsInfo['streams'] = readSubStreamsInfo(reader, streamsInfo['folders'])
+		else:
+			raise SevenZipHeaderError('Unexpected property in streams info')
+	if streamsInfo['streams'] is None:
+		streamsInfo['streams'] = [(folder.unpackSize(), folder.crc) for folder in streamsInfo['folders']]
+	return streamsInfo
+
+def readFilesInfo(reader: HeaderReader) -> list:
+	numFiles = reader.number()
+	files = [{'name': '', 'emptyStream': False} for i in range(numFiles)]
+	while (propertyId := reader.byte()) != kEnd:
+		size = reader.number()
+		end = reader.pos + size
+		if propertyId == kEmptyStream:
+			for f, empty in zip(files, reader.bits(numFiles)):
+				f['emptyStream'] = empty
+		elif propertyId == kName:
+			if reader.byte():
+				raise SevenZipHeaderError('External file names are not supported')
+			names = reader.bytes(end - reader.pos).decode('utf-16-le').split('\x00')
+			for f, name in zip(files, names):
+				f['name'] = name
+		# Anything else (times, attributes, empty files, ...) is not needed for a listing
+		reader.pos = end
+	return files
+
+def decodeHeader(f, reader: HeaderReader) -> bytes:
+	# The real header was compressed, and described by a streams info
+	streamsInfo = readStreamsInfo(reader)
+	packInfo = streamsInfo['packInfo']
+	if not packInfo or len(streamsInfo['folders']) != 1:
+		raise SevenZipHeaderError('Unsupported encoded header')
+	folder = streamsInfo['folders'][0]
+	if len(folder.coders) != 1:
+		raise SevenZipHeaderError('Unsupported encoded header')
+	f.seek(SIGNATURE_HEADER_SIZE + packInfo['packPos'])
+	packed = f.read(packInfo['sizes'][0])
+	if len(packed) != packInfo['sizes'][0]:
+		raise SevenZipHeaderError('Truncated archive')
+	coder = folder.coders[0]
+	if coder['id'] == COPY:
+		data = packed
+	elif coder['id'] == LZMA:
+		properties = coder['properties']
+		lc = properties[0] % 9
+		lp = (properties[0] // 9) % 5
+		pb = properties[0] // 45
+		dictSize = struct.unpack('<I', properties[1:5])[0]
+		filters = [{'id': lzma.FILTER_LZMA1, 'dict_size': dictSize, 'lc': lc, 'lp': lp, 'pb': pb}]
+		data = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=filters).decompress(packed, folder.unpackSize())
+	elif coder['id'] == LZMA2:
+		bits = coder['properties'][0]
+		dictSize = 0xffffffff if bits == 40 else (2 | (bits & 1)) << (bits // 2 + 11)
+		filters = [{'id': lzma.FILTER_LZMA2, 'dict_size': dictSize}]
+		data = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=filters).decompress(packed, folder.unpackSize())
+	else:
+		raise SevenZipHeaderError('Unsupported encoded header compression')
+	data = data[:folder.unpackSize()]
+	if folder.crc is not None and binascii.crc32(data) != folder.crc:
+		raise SevenZipHeaderError('Bad encoded header CRC')
+	return data
+
+def readHeader(f) -> HeaderReader:
+	signatureHeader = f.read(SIGNATURE_HEADER_SIZE)
+	if len(signatureHeader) != SIGNATURE_HEADER_SIZE or not signatureHeader.startswith(SIGNATURE):
+		raise SevenZipHeaderError('Not a 7z archive')
+	startHeaderCRC, = struct.unpack('<I', signatureHeader[8:12])
+	if binascii.crc32(signatureHeader[12:32]) != startHeaderCRC:
+		raise SevenZipHeaderError('Bad start header CRC')
+	nextHeaderOffset, nextHeaderSize, nextHeaderCRC = struct.unpack('<QQI', signatureHeader[12:32])
+	if nextHeaderSize == 0:
+		return None
+	f.seek(SIGNATURE_HEADER_SIZE + nextHeaderOffset)
+	data = f.read(nextHeaderSize)
+	if len(data) != nextHeaderSize:
+		raise SevenZipHeaderError('Truncated archive')
+	if binascii.crc32(data) != nextHeaderCRC:
+		raise SevenZipHeaderError('Bad header CRC')
+	reader = HeaderReader(data)
+	# An archive may be written with several levels of encoded headers
+	while (propertyId := reader.byte()) == kEncodedHeader:
+		reader = HeaderReader(decodeHeader(f, reader))
+	if propertyId != kHeader:
+		raise SevenZipHeaderError('Unexpected property in header')
+	return reader
+
+def listMembers(path: str) -> list:
+	"""
+	Name, size and CRC of every file of a 7z archive, in the same layout as archive.Archive.members().
+	Raises SevenZipHeaderError on headers this reader doesn't handle (like encrypted ones).
+	"""
+	with open(path, 'rb') as f:
+		reader = readHeader(f)
+		if reader is None:
+			return []
+		streams = []
+		files = []
+		while (propertyId := reader.byte()) != kEnd:
+			if propertyId == kArchiveProperties:
+				while reader.byte() != kEnd:
+					reader.bytes(reader.number())
+			elif propertyId == kAdditionalStreamsInfo:
+				readStreamsInfo(reader)
+			elif propertyId == kMainStreamsInfo:
+				streams = readStreamsInfo(reader)['streams']
+			elif propertyId == kFilesInfo:
+				files = readFilesInfo(reader)
+			else:
+				raise SevenZipHeaderError('Unexpected property in header')
+	members = []
+	streams = iter(streams)
+	for f in files:
+		size, crc = (0, 0) if f['emptyStream'] else next(streams, (0, None))
+		members.append({'name': f['name'], 'size': size, 'crc': f'{crc or 0:08x}'})
+	return members
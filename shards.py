@@ -0,0 +1,123 @@
+import argparse
+import hashlib
+import os
+import sys
+
+import sinks
+
+"""
+Split a scan across several machines: with --shard i/N, a scan only parses the files whose relative
+path hashes to shard i, so N scans of the same folder share its files without talking to each other.
+The outputs of the N shards are then merged into one, checking that every shard is there and complete.
+"""
+
+def parse_shard(spec: str) -> tuple:
+    # i/N, i from 0 to N-1
+    try:
+        index, count = (int(n) for n in spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected i/N, got %s" % spec)
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("shard index must be from 0 to %d, got %s" % (count - 1, spec))
+    return (index, count)
+
+def shard_of(relative_path: str, count: int) -> int:
+    """
+    Shard of a file from its path relative to the scanned folder: the same wherever the folder is
+    mounted, on any OS and in any process (unlike hash(), which is salted per process).
+    """
+    key = relative_path.replace(os.sep, '/').encode('utf-8', 'surrogateescape')
+    return int.from_bytes(hashlib.sha1(key).digest()[:8], 'big') % count
+
+def relative_source(source: str, root: str) -> str:
+    # Shards write absolute sources and root: the key doesn't depend on the folder merge is run from
+    return os.path.relpath(source, root).replace(os.sep, '/')
+
+def check_summaries(summaries: dict) -> list:
+    """
+    Problems which prevent merging the shards: missing summary (shard interrupted, or not a shard),
+    shards of different splits, missing or duplicate shards, results lost from a shard output.
+    """
+    problems = []
+    shards = dict()
+    counts = set()
+    for spec, (summary, nb_results) in summaries.items():
+        if not summary:
+            problems.append("%s: no shard summary, the scan was interrupted or not sharded" % spec)
+            continue
+        counts.add(summary['count'])
+        if summary['index'] in shards:
+            problems.append("%s: shard %d/%d already in %s" % (spec, summary['index'], summary['count'], shards[summary['index']]))
+        shards[summary['index']] = spec
+        if nb_results != summary['files']:
+            problems.append("%s: %d results, the shard scanned %d files" % (spec, nb_results, summary['files']))
+    if len(counts) > 1:
+        problems.append("Shards of different splits: %s" % ', '.join('/%d' % count for count in sorted(counts)))
+    elif counts:
+        count = counts.pop()
+        missing = sorted(set(range(count)) - set(shards))
+        if missing:
+            problems.append("Missing shards: %s" % ', '.join('%d/%d' % (index, count) for index in missing))
+    return problems
+
+def merge(output: str, inputs: list, allow_incomplete: bool = False) -> int:
+    # First pass: the summary of each shard, and its number of results
+    summaries = dict()
+    for spec in inputs:
+        summary = None
+        nb_results = 0
+        for record in sinks.read_output(spec):
+            if 'shard_summary' in record:
+                summary = record['shard_summary']
+            else:
+                nb_results += 1
+        summaries[spec] = (summary, nb_results)
+    problems = check_summaries(summaries)
+    for problem in problems:
+        print(problem)
+    if problems and not allow_incomplete:
+        print("Not merged, use --allow-incomplete to merge anyway")
+        return 1
+
+    # Second pass: the results, once per file
+    seen = set()
+    nb_results = 0
+    nb_duplicates = 0
+    nb_misplaced = 0
+    with sinks.make_sink(output) as sink:
+        for spec in inputs:
+            summary = summaries[spec][0]
+            for record in sinks.read_output(spec):
+                if 'shard_summary' in record:
+                    continue
+                source = record['source']
+                key = relative_source(source, summary['root']) if summary else source
+                if key in seen:
+                    nb_duplicates += 1
+                    continue
+                seen.add(key)
+                if summary and shard_of(key, summary['count']) != summary['index']:
+                    print("%s: %s doesn't belong to shard %d/%d" % (spec, source, summary['index'], summary['count']))
+                    nb_misplaced += 1
+                if set(record) == {'source', 'error'}:
+                    sink.write(source, None, record['error'])
+                else:
+                    sink.write(source, record)
+                nb_results += 1
+    print("Merged %d shard(s) into %s: %d files, %d duplicates dropped, %d in the wrong shard" % (len(inputs), output,
+        nb_results, nb_duplicates, nb_misplaced))
+    return 1 if nb_misplaced and not allow_incomplete else 0
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog='main.py merge', description='Merge the outputs of the shards of a scan into one')
+    parser.add_argument("--output", "-o", help="Merged output, as format:path or a path ending with .jsonl, .csv or .db", required=True)
+    parser.add_argument("--allow-incomplete", help="Merge even if shards are missing, interrupted or don't match", action='store_true')
+    parser.add_argument("inputs", nargs='+', help="Outputs of the shards (JSON Lines or SQLite)")
+    args = parser.parse_args(argv)
+    if sinks.uses_stdout([args.output]):
+        # The merged results are written to stdout, the messages go to stderr
+        sys.stdout = sys.stderr
+    return merge(args.output, args.inputs, args.allow_incomplete)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
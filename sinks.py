@@ -0,0 +1,270 @@
+import abc
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+
+"""
+Outputs of a scan: each result is written as soon as it's known, so nothing needs to be kept in memory
+and a consumer can read the output while the scan goes on. Writes are buffered, and flushed at most
+every FLUSH_INTERVAL seconds. An output path ending with .gz is compressed.
+An output is given as format:path, or just a path whose extension tells the format; '-' is stdout,
+the messages and the progress of the scan then go to stderr.
+The SQLite output is a queryable index of the library instead, committed every SQLITE_BATCH_SIZE rows.
+The JSON Lines and SQLite outputs of the shards of a scan can be read back to be merged.
+"""
+
+BUFFER_SIZE = 1024 * 1024
+FLUSH_INTERVAL = 1.0
+SQLITE_BATCH_SIZE = 1000
+
+# Props common to most systems, the others are only in the JSON Lines output
+CSV_COLUMNS = ['source', 'rom', 'cleaned_title', 'title', 'foreign_title', 'platform', 'publisher', 'region',
+    'serial', 'version', 'size', 'crc', 'md5', 'sha1', 'sha256', 'error']
+
+def open_text(path: str):
+    if path == '-':
+        # Even once sys.stdout is pointed to stderr for the messages
+        return sys.__stdout__
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'wb'), encoding='utf-8', newline='', write_through=False)
+    return open(path, 'w', encoding='utf-8', newline='', buffering=BUFFER_SIZE)
+
+# Props which have their own column in the SQLite output
+SQLITE_COLUMNS = {'source', 'rom', 'cleaned_title', 'title', 'serial', 'size', 'crc', 'md5', 'sha1', 'sha256'}
+
+class Sink(abc.ABC):
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @abc.abstractmethod
+    def write(self, source: str, result: dict | None, error = None):
+        pass
+
+    def remove(self, source: str):
+        # Only an index can forget about a file which was removed
+        pass
+
+    def write_summary(self, summary: dict):
+        # Written once a shard of a scan is complete, so merging its output can check it
+        pass
+
+    def flush(self):
+        # Makes what was written so far visible to the readers of the output
+        pass
+
+    def close(self):
+        pass
+
+class TextSink(Sink):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.file = open_text(path)
+        self.last_flush = time.monotonic()
+
+    def write(self, source: str, result: dict | None, error = None):
+        self.write_result(source, result, error)
+        if time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    @abc.abstractmethod
+    def write_result(self, source: str, result: dict | None, error = None):
+        pass
+
+    def flush(self):
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.path == '-':
+            self.file.flush()
+        else:
+            self.file.close()
+
+class JsonLinesSink(TextSink):
+    # One JSON object per file, the roms of an archive with several roms are in its 'members'
+    def write_result(self, source: str, result: dict | None, error = None):
+        if result is None:
+            result = {'source': source, 'error': str(error)}
+        self.file.write(json.dumps(result, default=str) + '\n')
+
+    def write_summary(self, summary: dict):
+        self.file.write(json.dumps({'shard_summary': summary}) + '\n')
+
+    @staticmethod
+    def read(path: str):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+class CsvSink(TextSink):
+    # One row per rom, the roms of an archive with several roms have a row each
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.writer = csv.DictWriter(self.file, CSV_COLUMNS, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write_result(self, source: str, result: dict | None, error = None):
+        if result is None:
+            self.writer.writerow({'source': source, 'error': str(error)})
+            return
+        for member in result.get('members', [result]):
+            self.writer.writerow({**member, 'source': source})
+
+class SqliteSink(Sink):
+    """
+    One row per file in files, per rom in members (the file itself, or each rom of an archive with
+    several), with its hashes in hashes and every other prop of its header in props. The main thread
+    is the only writer: rows are inserted as the results come, and committed by batches.
+    An existing index is updated: a file scanned again replaces its rows, and the rows of the files
+    removed since the previous scan (--since) or while watching are deleted. Without these, the rows
+    of files deleted between two scans stay.
+    """
+    def __init__(self, path: str, batch_size: int = SQLITE_BATCH_SIZE):
+        super().__init__(path)
+        self.batch_size = batch_size
+        self.pending = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, source TEXT UNIQUE, error TEXT);
+            CREATE TABLE IF NOT EXISTS members (id INTEGER PRIMARY KEY, file_id INTEGER REFERENCES files(id),
+                rom TEXT, cleaned_title TEXT, title TEXT, serial TEXT);
+            CREATE TABLE IF NOT EXISTS hashes (member_id INTEGER PRIMARY KEY REFERENCES members(id),
+                size INTEGER, crc TEXT, md5 TEXT, sha1 TEXT, sha256 TEXT);
+            CREATE TABLE IF NOT EXISTS props (member_id INTEGER REFERENCES members(id), key TEXT, value TEXT);
+            CREATE INDEX IF NOT EXISTS members_file ON members (file_id);
+            CREATE INDEX IF NOT EXISTS members_title ON members (title);
+            CREATE INDEX IF NOT EXISTS members_serial ON members (serial);
+            CREATE INDEX IF NOT EXISTS hashes_crc ON hashes (crc);
+            CREATE INDEX IF NOT EXISTS hashes_md5 ON hashes (md5);
+            CREATE INDEX IF NOT EXISTS hashes_sha1 ON hashes (sha1);
+            CREATE INDEX IF NOT EXISTS props_member ON props (member_id);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self.db.commit()
+
+    def write(self, source: str, result: dict | None, error = None):
+        # A file scanned again replaces what was known of it
+        self.remove(source)
+        file_id = self.db.execute("INSERT INTO files (source, error) VALUES (?, ?)",
+            (source, str(error) if error is not None else None)).lastrowid
+        self.pending += 1
+        for member in (result.get('members', [result]) if result is not None else []):
+            member_id = self.db.execute("INSERT INTO members (file_id, rom, cleaned_title, title, serial) VALUES (?, ?, ?, ?, ?)",
+                (file_id, member.get('rom'), member.get('cleaned_title'), member.get('title'), member.get('serial'))).lastrowid
+            self.db.execute("INSERT INTO hashes VALUES (?, ?, ?, ?, ?, ?)", (member_id, member.get('size'),
+                member.get('crc'), member.get('md5'), member.get('sha1'), member.get('sha256')))
+            props = [(member_id, key, str(value)) for key, value in member.items() if key not in SQLITE_COLUMNS]
+            self.db.executemany("INSERT INTO props VALUES (?, ?, ?)", props)
+            self.pending += 2 + len(props)
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def remove(self, source: str):
+        row = self.db.execute("SELECT id FROM files WHERE source = ?", (source,)).fetchone()
+        if not row:
+            return
+        members = "SELECT id FROM members WHERE file_id = ?"
+        self.db.execute("DELETE FROM props WHERE member_id IN (%s)" % members, row)
+        self.db.execute("DELETE FROM hashes WHERE member_id IN (%s)" % members, row)
+        self.db.execute("DELETE FROM members WHERE file_id = ?", row)
+        self.db.execute("DELETE FROM files WHERE id = ?", row)
+
+    def write_summary(self, summary: dict):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('shard_summary', ?)", (json.dumps(summary),))
+
+    def flush(self):
+        self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    @staticmethod
+    def read(path: str):
+        """
+        The results as the JSON Lines output has them, but for the props which all come back as strings.
+        An archive with a single rom comes back as a plain file.
+        """
+        db = sqlite3.connect(path)
+        try:
+            members = db.cursor()
+            for file_id, source, error in db.execute("SELECT id, source, error FROM files ORDER BY id"):
+                if error is not None:
+                    yield {'source': source, 'error': error}
+                    continue
+                roms = []
+                for row in members.execute("""SELECT m.id, m.rom, m.cleaned_title, m.title, m.serial, h.size, h.crc, h.md5, h.sha1, h.sha256
+                        FROM members m LEFT JOIN hashes h ON h.member_id = m.id WHERE m.file_id = ? ORDER BY m.id""", (file_id,)).fetchall():
+                    rom = {key: value for key, value in zip(['rom', 'cleaned_title', 'title', 'serial', 'size', 'crc', 'md5', 'sha1', 'sha256'], row[1:])
+                        if value is not None}
+                    rom.update(members.execute("SELECT key, value FROM props WHERE member_id = ?", (row[0],)).fetchall())
+                    roms.append(rom)
+                if len(roms) == 1:
+                    yield {**roms[0], 'source': source}
+                else:
+                    yield {'members': roms, 'source': source, 'rom': os.path.basename(source)}
+            summary = db.execute("SELECT value FROM meta WHERE key = 'shard_summary'").fetchone()
+            if summary:
+                yield {'shard_summary': json.loads(summary[0])}
+        finally:
+            db.close()
+
+SINKS = {
+    'jsonl': JsonLinesSink,
+    'csv': CsvSink,
+    'sqlite': SqliteSink,
+}
+
+# Formats told by the extension of the output
+EXTENSIONS = {
+    'jsonl': 'jsonl',
+    'csv': 'csv',
+    'db': 'sqlite',
+    'sqlite': 'sqlite',
+}
+
+def output_format(spec: str) -> tuple:
+    """
+    (format, path) of an output given as format:path, or as a path ending with .jsonl, .csv (optionally .gz) or .db.
+    """
+    kind, sep, path = spec.partition(':')
+    if not sep or kind not in SINKS:
+        path = spec
+        name = spec[:-3] if spec.endswith('.gz') else spec
+        kind = EXTENSIONS.get(name.rsplit('.', 1)[-1].lower())
+        if not kind:
+            raise ValueError("Unknown output format of %s, expected one of: %s" % (spec, ', '.join(SINKS)))
+    return kind, path
+
+def uses_stdout(specs: list) -> bool:
+    return any(output_format(spec)[1] == '-' for spec in specs)
+
+def make_sink(spec: str, sqlite_batch_size: int = SQLITE_BATCH_SIZE) -> Sink:
+    kind, path = output_format(spec)
+    if kind == 'sqlite':
+        return SqliteSink(path, sqlite_batch_size)
+    return SINKS[kind](path)
+
+def read_output(spec: str):
+    """
+    Yield the results written to an output, then its summary as {'shard_summary': ...} if it has one.
+    """
+    kind, path = output_format(spec)
+    if not hasattr(SINKS[kind], 'read'):
+        raise ValueError("%s output can't be read back: %s" % (kind, spec))
+    return SINKS[kind].read(path)
@@ -0,0 +1,66 @@
+import os
+import struct
+
+"""
+What the scan knows of the storage under the files: which device holds them, whether it's a spinning
+disk, and where a file starts on it. Reads are grouped by device and ordered by position on the device,
+so a disk reads its files in one sweep instead of seeking back and forth between concurrent jobs.
+"""
+
+# ioctl(FS_IOC_FIEMAP) with room for a single extent: the first one gives where the file starts
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct('QQIIII')
+FIEMAP_EXTENT = struct.Struct('QQQQQIIII')
+
+def is_rotational(device: int) -> bool | None:
+    """
+    Whether the block device is a spinning disk, or None if it can't be told (network filesystems, not Linux...).
+    """
+    base = '/sys/dev/block/%d:%d' % (os.major(device), os.minor(device))
+    # Partitions don't have a queue, their disk has
+    for queue in (os.path.join(base, 'queue'), os.path.join(base, '..', 'queue')):
+        try:
+            with open(os.path.join(queue, 'rotational')) as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return None
+
+def physical_offset(path: str) -> int | None:
+    """
+    Offset on the device of the first extent of the file, or None if the filesystem doesn't tell.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # Not a Unix system, Windows for example
+        return None
+    buffer = bytearray(FIEMAP_HEADER.pack(0, 2**64 - 1, 0, 0, 1, 0) + bytes(FIEMAP_EXTENT.size))
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.ioctl(fd, FS_IOC_FIEMAP, buffer)
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
+    if not FIEMAP_HEADER.unpack_from(buffer)[3]:
+        # No extent: empty file, or its data is inlined
+        return None
+    return FIEMAP_EXTENT.unpack_from(buffer, FIEMAP_HEADER.size)[1]
+
+def read_position(path: str, st: os.stat_result, order: str = 'inode') -> tuple:
+    """
+    (device, position) of a file, reads are ordered by increasing position on a device.
+    Inode numbers mostly follow the layout of the disk, the physical extent is exact but costs an open().
+    By extent, the files whose extent is unknown come after the others, by inode number: an inode number
+    can't be compared with an offset.
+    """
+    if order == 'extent':
+        offset = physical_offset(path)
+        if offset is not None:
+            return (st.st_dev, (0, offset))
+        return (st.st_dev, (1, st.st_ino))
+    if order == 'walk':
+        return (st.st_dev, 0)
+    return (st.st_dev, st.st_ino)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import sys
+import tempfile
+import tracemalloc
+import unittest
+import zipfile
+import zlib
+from unittest import mock
+
+import py7zr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive
+from rom import CHUNK_SIZE, Rom
+
+# Synthetic disc image, sparse: it takes no room on the disk
+IMAGE_SIZE = 2 * 1024 * 1024 * 1024
+# Archived roms, stored deflated
+MEMBER_SIZE = 256 * 1024 * 1024
+# Peak of Python allocations allowed while hashing, whatever the size of the file
+MAX_PEAK = 8 * CHUNK_SIZE
+# Archived rom of the 7z tests, several times the blocks py7zr decompresses at once
+SEVENZIP_ROM_SIZE = 4 * 1024 * 1024
+
+# Neither a multiple of the chunk size nor of the blocks of the decompressors
+ODD_SIZE = 3 * CHUNK_SIZE + 12345
+
+def write_zeros(f, size: int):
+    zeros = bytes(CHUNK_SIZE)
+    for _ in range(size // CHUNK_SIZE):
+        f.write(zeros)
+
+def reference_hashes(data: bytes) -> dict:
+    return {'crc': f'{zlib.crc32(data):08x}', 'md5': hashlib.md5(data).hexdigest(), 'sha1': hashlib.sha1(data).hexdigest()}
+
+def zeros_hashes(size: int) -> dict:
+    # reference_hashes() of size zeros, without holding them
+    zeros = bytes(CHUNK_SIZE)
+    crc, md5, sha1 = 0, hashlib.md5(), hashlib.sha1()
+    for _ in range(size // CHUNK_SIZE):
+        crc = zlib.crc32(zeros, crc)
+        md5.update(zeros)
+        sha1.update(zeros)
+    return {'crc': f'{crc:08x}', 'md5': md5.hexdigest(), 'sha1': sha1.hexdigest()}
+
+class TestRomMemory(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.image = os.path.join(cls.tmpdir.name, 'image.iso')
+        with open(cls.image, 'wb') as f:
+            f.truncate(IMAGE_SIZE)
+        cls.archive = os.path.join(cls.tmpdir.name, 'roms.zip')
+        with zipfile.ZipFile(cls.archive, 'w', zipfile.ZIP_DEFLATED) as z:
+            for name in ('A.smc', 'B.smc'):
+                with z.open(name, 'w', force_zip64=True) as f:
+                    write_zeros(f, MEMBER_SIZE)
+        cls.singleArchive = os.path.join(cls.tmpdir.name, 'rom.zip')
+        with zipfile.ZipFile(cls.singleArchive, 'w', zipfile.ZIP_DEFLATED) as z:
+            with z.open('A.smc', 'w', force_zip64=True) as f:
+                write_zeros(f, MEMBER_SIZE)
+        cls.oddData = os.urandom(ODD_SIZE)
+        cls.oddRom = os.path.join(cls.tmpdir.name, 'odd.smc')
+        with open(cls.oddRom, 'wb') as f:
+            f.write(cls.oddData)
+        cls.oddArchive = os.path.join(cls.tmpdir.name, 'odd.zip')
+        with zipfile.ZipFile(cls.oddArchive, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr('odd.smc', cls.oddData)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def peak(self, fn):
+        tracemalloc.start()
+        try:
+            result = fn()
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_image(self):
+        rom = Rom(self.image)
+        hashes, peak = self.peak(rom.computeHashes)
+        self.assertEqual(hashes, zeros_hashes(IMAGE_SIZE))
+        self.assertLess(peak, MAX_PEAK)
+
+    def test_archived_rom(self):
+        rom = Rom(self.singleArchive)
+        hashes, peak = self.peak(rom.computeHashes)
+        self.assertEqual(hashes, zeros_hashes(MEMBER_SIZE))
+        self.assertLess(peak, MAX_PEAK)
+
+    def test_archived_roms(self):
+        rom = Rom(self.archive)
+        roms, peak = self.peak(lambda: rom.readArchivedRoms(keepSize=0x8000))
+        self.assertEqual(sorted(roms), ['A.smc', 'B.smc'])
+        for name in roms:
+            self.assertEqual(roms[name]['hashes'], zeros_hashes(MEMBER_SIZE))
+        self.assertEqual(roms['A.smc']['data'], bytes(0x8000))
+        self.assertLess(peak, MAX_PEAK)
+
+    def test_odd_size(self):
+        for path in (self.oddRom, self.oddArchive):
+            with self.subTest(path=os.path.basename(path)):
+                self.assertEqual(Rom(path).computeHashes(), reference_hashes(self.oddData))
+
+class TestRomSevenZip(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.data = os.urandom(SEVENZIP_ROM_SIZE)
+        cls.singleArchive = os.path.join(cls.tmpdir.name, 'rom.7z')
+        with py7zr.SevenZipFile(cls.singleArchive, 'w') as z:
+            z.writestr(cls.data, 'A.gba')
+        # Several roms in one solid block, of sizes that aren't a multiple of the blocks
+        cls.members = {name: os.urandom(size) for name, size in (('A.gba', 300000), ('B.gba', 1), ('C.gba', 1500001))}
+        cls.archive = os.path.join(cls.tmpdir.name, 'roms.7z')
+        with py7zr.SevenZipFile(cls.archive, 'w') as z:
+            for name, data in cls.members.items():
+                z.writestr(data, name)
+        # Stored as they are, with a byte of B.gba flipped
+        cls.corruptArchive = os.path.join(cls.tmpdir.name, 'corrupt.7z')
+        with py7zr.SevenZipFile(cls.corruptArchive, 'w', filters=[{'id': py7zr.FILTER_COPY}]) as z:
+            for name, data in cls.members.items():
+                z.writestr(data, name)
+        with open(cls.corruptArchive, 'r+b') as f:
+            stored = f.read()
+            f.seek(stored.index(cls.members['A.gba'] + cls.members['B.gba']) + len(cls.members['A.gba']))
+            f.write(bytes([cls.members['B.gba'][0] ^ 0xff]))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def decompressed(self, fn):
+        # Number of bytes py7zr hands to the archive members while fn runs
+        written = []
+        write = archive.MemberIO.write
+        def counted(member, s):
+            written.append(len(s))
+            return write(member, s)
+        with mock.patch.object(archive.MemberIO, 'write', counted):
+            return fn(), sum(written)
+
+    def test_header(self):
+        rom = Rom(self.singleArchive)
+        header, decompressed = self.decompressed(lambda: rom.readHeader(192))
+        self.assertEqual(header, self.data[:192])
+        # Stopped once the header was complete
+        self.assertLess(decompressed, len(self.data))
+        # The hashes are those of the whole rom all the same
+        self.assertEqual({h: rom.getHash(h) for h in ('crc', 'md5', 'sha1')}, reference_hashes(self.data))
+
+    def test_whole_rom(self):
+        # Without a known header size, past the spool size too
+        for spoolSize in (2 * SEVENZIP_ROM_SIZE, SEVENZIP_ROM_SIZE // 4):
+            with self.subTest(spoolSize=spoolSize):
+                rom = Rom(self.singleArchive, spoolSize=spoolSize, spoolDir=self.tmpdir.name)
+                data, decompressed = self.decompressed(lambda: rom.readHeader(None))
+                self.assertEqual(data, self.data)
+                # Hashed during the same decompression
+                hashes, hashed = self.decompressed(lambda: {h: rom.getHash(h) for h in ('crc', 'md5', 'sha1')})
+                self.assertEqual(hashes, reference_hashes(self.data))
+                self.assertEqual((decompressed, hashed), (len(self.data), 0))
+                self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['corrupt.7z', 'rom.7z', 'roms.7z'])
+
+    def test_archived_roms(self):
+        rom = Rom(self.archive)
+        roms, decompressed = self.decompressed(lambda: rom.readArchivedRoms(keepSize=0x100))
+        self.assertEqual(sorted(roms), sorted(self.members))
+        for name, data in self.members.items():
+            self.assertEqual(roms[name]['hashes'], reference_hashes(data))
+            self.assertEqual(roms[name]['data'], data[:0x100])
+        # The solid block is decompressed once for all of them
+        self.assertEqual(decompressed, sum(len(data) for data in self.members.values()))
+
+    def test_archived_roms_handed_one_by_one(self):
+        handed = {}
+        Rom(self.archive).readArchivedRoms(keepSize=None, onRom=handed.__setitem__)
+        for name, data in self.members.items():
+            self.assertEqual(handed[name]['hashes']['crc'], f'{zlib.crc32(data):08x}')
+            self.assertEqual(handed[name]['data'], data)
+
+    def test_corrupt_member(self):
+        handed = {}
+        with self.assertRaises(py7zr.exceptions.CrcError):
+            Rom(self.corruptArchive).readArchivedRoms(keepSize=None, onRom=handed.__setitem__)
+        self.assertNotIn('B.gba', handed)
+        self.assertEqual(handed['A.gba']['data'], self.members['A.gba'])
+
+    def test_member_closed_on_error(self):
+        # Closed while leaving the block it was written in, as py7zr may do
+        for data, error in ((b'abc', py7zr.exceptions.CrcError(1, 2, 'A.gba')), (b'ab', None)):
+            with self.subTest(data=data):
+                handed = {}
+                member = archive.MemberIO(keepSize=None, fileName='A.gba', onComplete=handed.__setitem__, expectedSize=3)
+                try:
+                    try:
+                        member.write(data)
+                        if error:
+                            raise error
+                    finally:
+                        member.close()
+                except py7zr.exceptions.CrcError:
+                    pass
+                self.assertEqual(handed, {})
+
+if __name__ == '__main__':
+    unittest.main()
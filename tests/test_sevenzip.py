@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+import unittest
+
+import py7zr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sevenzip
+
+FILTERS = {
+    'lzma2': [{'id': py7zr.FILTER_LZMA2}],
+    'lzma': [{'id': py7zr.FILTER_LZMA}],
+    'bcj': [{'id': py7zr.FILTER_X86}, {'id': py7zr.FILTER_LZMA2}],
+    'copy': [{'id': py7zr.FILTER_COPY}],
+}
+
+def files(count: int = 20) -> dict:
+    # Members of different sizes and contents, so each one has its own CRC, and an empty one
+    members = {'empty.gb': b''}
+    for i in range(count):
+        members['roms/rom%02d.gb' % i] = bytes([i]) * (i * 1000 + 1) + os.urandom(i * 100)
+    return members
+
+def py7zrMembers(path: str) -> list:
+    # What Archive.members() gives from py7zr, for comparison
+    with py7zr.SevenZipFile(path, 'r') as z:
+        return [{'name': f.filename, 'size': f.uncompressed, 'crc': f'{f.crc32 or 0:08x}'} for f in z.list()]
+
+class TestSevenZip(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.members = files()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name: str, filters = None, solid = True, encoded = True, **kwargs) -> str:
+        path = os.path.join(self.tmpdir.name, name)
+        if solid:
+            with py7zr.SevenZipFile(path, 'w', filters=filters, **kwargs) as z:
+                z.set_encoded_header_mode(encoded)
+                for fileName, data in self.members.items():
+                    z.writestr(data, fileName)
+            return path
+        # Each file appended to the archive gets its own folder
+        for i, (fileName, data) in enumerate(self.members.items()):
+            with py7zr.SevenZipFile(path, 'a' if i else 'w', filters=filters, **kwargs) as z:
+                z.set_encoded_header_mode(encoded)
+                z.writestr(data, fileName)
+        return path
+
+    def assertListedLikePy7zr(self, path: str):
+        members = sevenzip.listMembers(path)
+        self.assertEqual(members, py7zrMembers(path))
+        self.assertEqual(len(set(m['crc'] for m in members)), len(self.members))
+
+    def test_filters(self):
+        for name, filters in FILTERS.items():
+            for encoded in (True, False):
+                with self.subTest(filters=name, encoded=encoded):
+                    self.assertListedLikePy7zr(self.write('%s-%s.7z' % (name, encoded), FILTERS[name], encoded=encoded))
+
+    def test_solid(self):
+        path = self.write('solid.7z')
+        with py7zr.SevenZipFile(path, 'r') as z:
+            self.assertEqual(len(z.header.main_streams.unpackinfo.folders), 1)
+        self.assertListedLikePy7zr(path)
+
+    def test_non_solid(self):
+        path = self.write('non-solid.7z', solid=False)
+        with py7zr.SevenZipFile(path, 'r') as z:
+            self.assertGreater(len(z.header.main_streams.unpackinfo.folders), 1)
+        self.assertListedLikePy7zr(path)
+
+    def test_empty_archive(self):
+        path = os.path.join(self.tmpdir.name, 'empty.7z')
+        with py7zr.SevenZipFile(path, 'w'):
+            pass
+        self.assertEqual(sevenzip.listMembers(path), [])
+
+    def test_encrypted_header(self):
+        path = self.write('encrypted.7z', password='secret', header_encryption=True)
+        with self.assertRaises(sevenzip.SevenZipHeaderError):
+            sevenzip.listMembers(path)
+
+    def test_not_7z(self):
+        path = os.path.join(self.tmpdir.name, 'not.7z')
+        with open(path, 'wb') as f:
+            f.write(b'PK\x03\x04' + bytes(60))
+        with self.assertRaises(sevenzip.SevenZipHeaderError):
+            sevenzip.listMembers(path)
+
+    def test_truncated(self):
+        for encoded in (True, False):
+            path = self.write('truncated-%s.7z' % encoded, encoded=encoded)
+            with open(path, 'rb') as f:
+                data = f.read()
+            for length in (16, len(data) // 2, len(data) - 1):
+                with self.subTest(encoded=encoded, length=length):
+                    with open(path, 'wb') as f:
+                        f.write(data[:length])
+                    with self.assertRaises(sevenzip.SevenZipHeaderError):
+                        sevenzip.listMembers(path)
+
+    def test_zeroed_start_header(self):
+        # The end of the signature header lost: it must not pass for an empty archive
+        path = self.write('zeroed.7z')
+        with open(path, 'r+b') as f:
+            f.seek(16)
+            f.write(bytes(16))
+        with self.assertRaises(sevenzip.SevenZipHeaderError):
+            sevenzip.listMembers(path)
+
+    def test_corrupt_header(self):
+        for encoded in (True, False):
+            path = self.write('corrupt-%s.7z' % encoded, encoded=encoded)
+            with open(path, 'r+b') as f:
+                f.seek(-3, os.SEEK_END)
+                byte = f.read(1)
+                f.seek(-3, os.SEEK_END)
+                f.write(bytes([byte[0] ^ 0xff]))
+            with self.subTest(encoded=encoded), self.assertRaises(sevenzip.SevenZipHeaderError):
+                sevenzip.listMembers(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+import scanner
+
+"""
+Watch a roms folder once it was scanned, and report the files added, modified or removed since.
+Linux inotify is used through the C library when it's available, otherwise the folder is walked again
+every few seconds. Either way a changed file is only reported once its size and modification time stayed
+the same for a while, so a file still being copied is not parsed half-written.
+"""
+
+SETTLE_TIME = 2.0
+POLL_INTERVAL = 10.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+def file_signature(path: str) -> tuple | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def walk_signatures(root: str) -> dict:
+    return {entry.path: file_signature(entry.path) for entry in scanner.scan_files(root)}
+
+class Inotify:
+    """
+    Minimal inotify binding: a watch on every folder below root, new folders are watched as they appear.
+    """
+    def __init__(self, root: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.watches = dict()
+        try:
+            self.watch_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        os.close(self.fd)
+
+    def watch(self, directory: str):
+        wd = self.add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            # ENOSPC: out of watches, the caller falls back to polling
+            raise OSError(ctypes.get_errno(), "Can't watch %s: %s" % (directory, os.strerror(ctypes.get_errno())))
+        self.watches[wd] = directory
+
+    def watch_tree(self, root: str) -> list:
+        """
+        Watch root and its subfolders, and return the files found in them.
+        """
+        self.watch(root)
+        files = []
+        for directory, dirnames, filenames in os.walk(root):
+            for dirname in dirnames:
+                self.watch(os.path.join(directory, dirname))
+            files.extend(os.path.join(directory, filename) for filename in filenames)
+        return files
+
+    def read(self, timeout: float) -> tuple:
+        """
+        Wait up to timeout seconds for events, return the paths they touched and whether events were lost.
+        """
+        paths = set()
+        overflow = False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return paths, overflow
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            directory = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # A folder created or moved in: its content is new too
+                    paths.update(self.watch_tree(path))
+                elif mask & IN_MOVED_FROM:
+                    # Its files are reported removed by the full check of the caller
+                    overflow = True
+            else:
+                paths.add(path)
+        return paths, overflow
+
+def watch(root: str, known: dict, settle_time: float = SETTLE_TIME, poll_interval: float = POLL_INTERVAL):
+    """
+    Yield (changed, removed) lists of paths each time files below root changed. known maps the paths
+    of the files found by the initial scan to their (size, mtime_ns), it's kept up to date.
+    """
+    try:
+        inotify = Inotify(root)
+    except (OSError, AttributeError) as e:
+        print("Polling %s every %g seconds (inotify is not available: %s)" % (root, poll_interval, e))
+        inotify = None
+    # Changed files waiting for their size and modification time to settle: path -> (signature, since)
+    pending = dict()
+    next_poll = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            if inotify:
+                paths, overflow = inotify.read(settle_time if pending else None)
+            else:
+                time.sleep(max(0, min([next_poll] + [since + settle_time for _, since in pending.values()]) - now))
+                paths, overflow = set(), time.monotonic() >= next_poll
+            now = time.monotonic()
+            if overflow:
+                # Polling, or inotify events were lost: compare the whole tree with what's known
+                next_poll = now + poll_interval
+                current = walk_signatures(root)
+                paths.update(path for path, signature in current.items() if known.get(path) != signature)
+                paths.update(path for path in known if path not in current)
+            for path in paths:
+                signature = file_signature(path)
+                if path not in pending or pending[path][0] != signature:
+                    pending[path] = (signature, now)
+            changed = []
+            removed = []
+            for path, (signature, since) in list(pending.items()):
+                if now - since < settle_time:
+                    continue
+                # Settled: only report it if it's still the same
+                current = file_signature(path)
+                if current != signature:
+                    pending[path] = (current, now)
+                    continue
+                del pending[path]
+                if signature is None:
+                    if path in known:
+                        del known[path]
+                        removed.append(path)
+                elif known.get(path) != signature:
+                    known[path] = signature
+                    changed.append(path)
+            if changed or removed:
+                yield changed, removed
+    finally:
+        if inotify:
+            inotify.close()